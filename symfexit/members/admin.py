@@ -197,6 +197,7 @@ class BaseUserAdmin(ExportMixin, admin.ModelAdmin):
     add_form = UserCreationForm
     change_password_form = AdminPasswordChangeForm
     list_display = ("email", "first_name", "last_name", "is_staff", "credit_balance_display")
+    list_select_related = ("credit_account__balance",)
     list_filter = (
         "is_staff",
         "is_superuser",
@@ -357,6 +357,7 @@ class OrderAdmin(admin.ModelAdmin):
                 )
                 instance.transaction = transaction
                 instance.save()
+                instance.obligation.update_settled()
             else:
                 instance.save()
         formset.save_m2m()
@@ -486,7 +487,10 @@ class PaymentObligationAdmin(admin.ModelAdmin):
                 instance.transaction = transaction
                 instance.order = obligation.order
                 instance.obligation = obligation
-            instance.save()
+                instance.save()
+                obligation.update_settled()
+            else:
+                instance.save()
         formset.save_m2m()
 
     def changelist_view(self, request, extra_context=None):
@@ -30,9 +30,12 @@ class PaymentsConfig(AppConfig):
     def ready(self):
         from django.db.models.signals import post_migrate  # noqa: PLC0415
 
+        from symfexit.payments.models import Account, PaymentProvider  # noqa: PLC0415
         from symfexit.payments.registry import payments_registry  # noqa: PLC0415
+        from symfexit.worker import tenantcache  # noqa: PLC0415
 
         self.module.autodiscover()
+        tenantcache.invalidate_on_change(Account, PaymentProvider)
         payments_registry.initialize()
         post_migrate.connect(create_default_providers, sender=self)
 
@@ -48,7 +51,7 @@ class PaymentsConfig(AppConfig):
             return [
                 _(
                     "Payment obligations haven't been generated recently. "
-                    "Make sure the generate_obligations command is scheduled."
+                    "Make sure the worker is running."
                 )
             ]
 
@@ -1,23 +1,22 @@
-from django.conf import settings
 from django.core.management import BaseCommand
-from django_tenants.utils import get_public_schema_name, get_tenant_model, tenant_context
+from django_tenants.utils import tenant_context
 
-from symfexit.worker.registry import add_task
+from symfexit.worker.registry import DuplicateTask, add_task
+from symfexit.worker.scheduler import active_tenants
 
 
 class Command(BaseCommand):
     help = "Queue recurring payment charging for all tenants"
 
     def handle(self, *args, **options):
-        TenantModel = get_tenant_model()
-        if settings.SINGLE_SITE:
-            tenants = TenantModel.objects.all()
-        else:
-            tenants = TenantModel.objects.exclude(schema_name=get_public_schema_name())
+        tenants = active_tenants()
 
         for tenant in tenants:
             self.stdout.write(f"Queuing for tenant: {tenant.name}")
             with tenant_context(tenant):
-                add_task("charge_obligations")
+                try:
+                    add_task("charge_obligations", dedupe_key="charge_obligations")
+                except DuplicateTask:
+                    self.stdout.write(f"Already queued for tenant: {tenant.name}")
 
         self.stdout.write(self.style.SUCCESS(f"Queued for {tenants.count()} tenant(s)"))
@@ -1,10 +1,10 @@
 from datetime import date
 
-from django.conf import settings
 from django.core.management import BaseCommand
-from django_tenants.utils import get_public_schema_name, get_tenant_model, tenant_context
+from django_tenants.utils import tenant_context
 
-from symfexit.worker.registry import add_task
+from symfexit.worker.registry import DuplicateTask, add_task
+from symfexit.worker.scheduler import active_tenants
 
 
 class Command(BaseCommand):
@@ -25,16 +25,17 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         now = options["now"]
 
-        TenantModel = get_tenant_model()
-        if settings.SINGLE_SITE:
-            tenants = TenantModel.objects.all()
-        else:
-            tenants = TenantModel.objects.exclude(schema_name=get_public_schema_name())
+        tenants = active_tenants()
 
+        # Overlapping runs for the same "now" would scan the same orders
+        dedupe_key = f"gen_obligations:{now.isoformat()}" if now else "gen_obligations"
         for tenant in tenants:
             self.stdout.write(f"Queuing for tenant: {tenant.name}")
             with tenant_context(tenant):
-                add_task("gen_obligations", now=now)
+                try:
+                    add_task("gen_obligations", now=now, dedupe_key=dedupe_key)
+                except DuplicateTask:
+                    self.stdout.write(f"Already queued for tenant: {tenant.name}")
 
         suffix = f" (override now={now.isoformat()})" if now else ""
         self.stdout.write(self.style.SUCCESS(f"Queued for {tenants.count()} tenant(s){suffix}"))
@@ -0,0 +1,56 @@
+from django.core.management import BaseCommand
+from django.db import connection, transaction
+from django_tenants.utils import tenant_context
+
+from symfexit.payments.models import AccountBalance
+from symfexit.worker.scheduler import active_tenants
+
+
+class Command(BaseCommand):
+    help = "Check the stored account balances of all tenants against their transactions"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--fix",
+            action="store_true",
+            help="Replace balances that don't match with the ones recomputed from the transactions.",
+        )
+
+    def handle(self, *args, **options):
+        mismatches = 0
+        for tenant in active_tenants():
+            with tenant_context(tenant), transaction.atomic(), connection.cursor() as cursor:
+                # Hold off new transactions while comparing, they'd change both sides
+                cursor.execute(f"LOCK TABLE {AccountBalance._meta.db_table} IN SHARE MODE")
+                mismatches += self.verify_tenant(tenant, fix=options["fix"])
+
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS("All account balances match their transactions"))
+        elif options["fix"]:
+            self.stdout.write(self.style.SUCCESS(f"Fixed {mismatches} account balance(s)"))
+        else:
+            self.stdout.write(
+                self.style.ERROR(f"{mismatches} account balance(s) don't match, run with --fix")
+            )
+
+    def verify_tenant(self, tenant, *, fix):
+        stored = {balance.account_id: balance for balance in AccountBalance.objects.all()}
+        expected = AccountBalance.from_journal()
+        mismatches = 0
+        for account_id in stored.keys() | expected.keys():
+            balance = stored.get(account_id, AccountBalance(account_id=account_id))
+            journal = expected.get(account_id, AccountBalance(account_id=account_id))
+            if (balance.credit_cents, balance.debit_cents) == (
+                journal.credit_cents,
+                journal.debit_cents,
+            ):
+                continue
+            mismatches += 1
+            self.stdout.write(
+                f"{tenant.name}: account {account_id} has credit {balance.credit_cents} and "
+                f"debit {balance.debit_cents}, transactions add up to credit "
+                f"{journal.credit_cents} and debit {journal.debit_cents}"
+            )
+            if fix:
+                journal.save()
+        return mismatches
@@ -0,0 +1,28 @@
+# Generated by Django 6.0.4 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0002_remove_payment_order_order_product_type"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="order",
+            name="next_due_at",
+            field=models.DateTimeField(
+                editable=False, null=True, verbose_name="next obligation due at"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                condition=models.Q(("cancelled_at__isnull", True), ("subscription__isnull", False)),
+                fields=["next_due_at"],
+                name="order_next_due_at_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 6.0.4 on 2026-10-18 15:05
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def set_settled(apps, schema_editor):
+    PaymentObligation = apps.get_model("payments", "PaymentObligation")
+    Payment = apps.get_model("payments", "Payment")
+    paid = (
+        Payment.objects.filter(obligation=OuterRef("pk"))
+        .values("obligation")
+        .annotate(total=Sum("transaction__amount_cents"))
+        .values("total")
+    )
+    settled = (
+        PaymentObligation.objects.annotate(
+            due_cents=models.ExpressionWrapper(
+                F("amount_euros") * 100, output_field=models.DecimalField()
+            ),
+            paid_cents=Coalesce(Subquery(paid), 0),
+        )
+        .filter(due_cents__lte=F("paid_cents"))
+        .values("pk")
+    )
+    PaymentObligation.objects.filter(pk__in=settled).update(settled=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0003_order_next_due_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="paymentobligation",
+            name="settled",
+            field=models.BooleanField(default=False, editable=False, verbose_name="settled"),
+        ),
+        migrations.AddIndex(
+            model_name="paymentobligation",
+            index=models.Index(
+                condition=models.Q(("settled", False)),
+                fields=["id"],
+                name="paymentobligation_unsettled_idx",
+            ),
+        ),
+        migrations.RunPython(set_settled, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 6.0.4 on 2026-10-18 16:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def fill_balances(apps, schema_editor):
+    AccountBalance = apps.get_model("payments", "AccountBalance")
+    Transaction = apps.get_model("payments", "Transaction")
+    balances = {}
+    for side in ("credit", "debit"):
+        for account_id, total in (
+            Transaction.objects.values(f"{side}_account_id")
+            .annotate(total=Sum("amount_cents"))
+            .values_list(f"{side}_account_id", "total")
+            .order_by()
+        ):
+            balance = balances.setdefault(account_id, AccountBalance(account_id=account_id))
+            setattr(balance, f"{side}_cents", total)
+    AccountBalance.objects.bulk_create(balances.values())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0004_paymentobligation_settled"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AccountBalance",
+            fields=[
+                (
+                    "account",
+                    models.OneToOneField(
+                        db_constraint=False,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        primary_key=True,
+                        related_name="balance",
+                        serialize=False,
+                        to="payments.account",
+                    ),
+                ),
+                ("credit_cents", models.BigIntegerField(default=0)),
+                ("debit_cents", models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(fill_balances, migrations.RunPython.noop),
+    ]
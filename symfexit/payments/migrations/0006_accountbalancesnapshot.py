@@ -0,0 +1,60 @@
+# Generated by Django 6.0.4 on 2026-10-18 17:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("payments", "0005_accountbalance"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AccountBalanceSnapshot",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("closed_at", models.DateTimeField()),
+                ("credit_cents", models.BigIntegerField(default=0)),
+                ("debit_cents", models.BigIntegerField(default=0)),
+                (
+                    "account",
+                    models.ForeignKey(
+                        db_constraint=False,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="balance_snapshots",
+                        to="payments.account",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("account", "closed_at"), name="accountbalancesnapshot_unique"
+                    )
+                ],
+            },
+        ),
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(fields=["created_at"], name="transaction_created_at_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(
+                fields=["credit_account", "created_at"], name="transaction_credit_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(
+                fields=["debit_account", "created_at"], name="transaction_debit_created_idx"
+            ),
+        ),
+    ]
@@ -3,13 +3,19 @@ import os
 import time
 import uuid
 import zoneinfo
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import date, datetime, timedelta
 from uuid import uuid4
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.db import IntegrityError, connection, models, transaction
-from django.db.models import Q
+from django.db.models import F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Cast, Coalesce
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.shortcuts import get_object_or_404
 from django.utils.formats import date_format
 from django.utils.translation import gettext_lazy as _
@@ -17,6 +23,7 @@ from hashids import Hashids
 
 from symfexit.members.admin import Member
 from symfexit.payments.registry import PaymentProcessor
+from symfexit.worker import tenantcache
 
 hashids = Hashids(min_length=8, salt=settings.SECRET_KEY)
 
@@ -115,6 +122,14 @@ class BillingAddress(models.Model):
         return address
 
 
+class TransactionQuerySet(models.QuerySet):
+    def bulk_create(self, objs, *args, **kwargs):
+        with transaction.atomic(using=self.db):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            AccountBalance.add(objs)
+        return objs
+
+
 class Transaction(models.Model):
     id = models.UUIDField(primary_key=True, default=tigerbeetle_id, editable=False)
     # FKs use db_constraint=False + DO_NOTHING so the ledger is immutable
@@ -138,11 +153,32 @@ class Transaction(models.Model):
     part_of = models.UUIDField(default=tigerbeetle_id)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = TransactionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # For the transactions of a period, see AccountBalanceSnapshot
+            models.Index(fields=["created_at"], name="transaction_created_at_idx"),
+            models.Index(
+                fields=["credit_account", "created_at"], name="transaction_credit_created_idx"
+            ),
+            models.Index(
+                fields=["debit_account", "created_at"], name="transaction_debit_created_idx"
+            ),
+        ]
+
     def __str__(self):
         credit_account = self.get_credit_account() or self.credit_account_id
         debit_account = self.get_debit_account() or self.debit_account_id
         return f"Transaction of €{self.amount_cents / 100:.2f} from {credit_account} to {debit_account}"
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                AccountBalance.add([self])
+
     def get_credit_account(self) -> Account | None:
         return Account.objects.filter(id=self.credit_account_id).first()
 
@@ -168,12 +204,12 @@ class GeneralLedger(models.Model):
         return self.name
 
     def balance_cents(self):
-        credit_balances = Transaction.objects.filter(credit_account__general_ledger=self).aggregate(
-            models.Sum("amount_cents", default=0)
-        )["amount_cents__sum"]
-        debit_balances = Transaction.objects.filter(debit_account__general_ledger=self).aggregate(
-            models.Sum("amount_cents", default=0)
-        )["amount_cents__sum"]
+        totals = AccountBalance.objects.filter(account__general_ledger=self).aggregate(
+            credit=models.Sum("credit_cents", default=0),
+            debit=models.Sum("debit_cents", default=0),
+        )
+        credit_balances = totals["credit"]
+        debit_balances = totals["debit"]
         if self.credit_balance:
             return credit_balances - debit_balances
         else:
@@ -207,6 +243,17 @@ class Account(models.Model):
     def __str__(self):
         return f"{self.name} ({self.code})"
 
+    @classmethod
+    def _get_or_create_by_code(cls, code, defaults):
+        """The account with `code`, cached per tenant in the worker; see `worker.tenantcache`."""
+        key = f"account:{code}"
+        account = tenantcache.get(key)
+        if account is not None:
+            return account, False
+        account, created = cls.objects.get_or_create(code=code, defaults=defaults)
+        tenantcache.store(key, account)
+        return account, created
+
     @classmethod
     def get_accounts_receivable_account(cls):
         """Money that has been invoiced, but not received yet.
@@ -214,8 +261,8 @@ class Account(models.Model):
         In RGS this is mapped to BVorDebHad (13011).
         See: https://www.boekhoudplaza.nl/rgs_rekeningen/BVorDebHad&KB=R&kzB=SVC/Debiteuren.htm
         """
-        return cls.objects.get_or_create(
-            code=ACCOUNT_ACCOUNTS_RECEIVABLE,
+        return cls._get_or_create_by_code(
+            ACCOUNT_ACCOUNTS_RECEIVABLE,
             defaults={
                 "name": _("Accounts Receivable"),
                 "description": _(
@@ -234,8 +281,8 @@ class Account(models.Model):
         In RGS this is mapped to WLbeLbvLbv (82811).
         See: https://www.boekhoudplaza.nl/rgs_rekeningen/WLbeLbvLbv&KB=R&kzB=SVC&rgsv=WLbeLbvLbv/Ledenbetalingen_inclusief_reeds_betaalde_voorschotten.htm
         """
-        return cls.objects.get_or_create(
-            code=ACCOUNT_REVENUE,
+        return cls._get_or_create_by_code(
+            ACCOUNT_REVENUE,
             defaults={
                 "name": _("Revenue"),
                 "description": _(
@@ -254,8 +301,8 @@ class Account(models.Model):
         In RGS this is mapped to WBedVkkAdd (45661).
         See: https://www.boekhoudplaza.nl/rgs_rekeningen/WBedVkkAdd&KB=R&kzB=SVC/Afboeking_dubieuze_debiteuren.htm
         """
-        return cls.objects.get_or_create(
-            code=ACCOUNT_WAIVED,
+        return cls._get_or_create_by_code(
+            ACCOUNT_WAIVED,
             defaults={
                 "name": _("Waived Payments"),
                 "description": _(
@@ -275,8 +322,8 @@ class Account(models.Model):
 
         In RGS this is mapped to BLimBanRba (10201).
         """
-        return cls.objects.get_or_create(
-            code=ACCOUNT_BANK,
+        return cls._get_or_create_by_code(
+            ACCOUNT_BANK,
             defaults={
                 "name": _("Bank"),
                 "description": _(
@@ -288,27 +335,302 @@ class Account(models.Model):
             },
         )
 
+    @classmethod
+    def balances_cents(cls, account_ids):
+        """`balance_cents` of many accounts in two queries, as a dict by account id."""
+        totals = {
+            balance.account_id: balance
+            for balance in AccountBalance.objects.filter(account_id__in=account_ids)
+        }
+        balances = {}
+        for account_id, credit_balance in cls.objects.filter(id__in=account_ids).values_list(
+            "id", "credit_balance"
+        ):
+            total = AccountBalance.with_deferred(
+                totals.get(account_id) or AccountBalance(account_id=account_id)
+            )
+            balance = total.credit_cents - total.debit_cents
+            balances[account_id] = balance if credit_balance else -balance
+        return balances
+
+    def _totals(self) -> AccountBalance:
+        # Use totals loaded with select_related("balance"), but never ones
+        # cached by an earlier read, which later transactions made stale
+        if Account.balance.is_cached(self):
+            totals = getattr(self, "balance", None)
+        else:
+            totals = AccountBalance.objects.filter(account_id=self.pk).first()
+        # An account without transactions has no totals yet
+        return AccountBalance.with_deferred(totals or AccountBalance(account_id=self.pk))
+
     def credit_balance_cents(self):
-        return self.credit_transactions.aggregate(models.Sum("amount_cents", default=0))[
-            "amount_cents__sum"
-        ]
+        return self._totals().credit_cents
 
     def debit_balance_cents(self):
-        return self.debit_transactions.aggregate(models.Sum("amount_cents", default=0))[
-            "amount_cents__sum"
-        ]
+        return self._totals().debit_cents
 
     def balance_cents(self):
-        credit_balance = self.credit_transactions.aggregate(models.Sum("amount_cents", default=0))[
-            "amount_cents__sum"
-        ]
-        debit_balance = self.debit_transactions.aggregate(models.Sum("amount_cents", default=0))[
-            "amount_cents__sum"
-        ]
+        totals = self._totals()
+        if self.credit_balance:
+            return totals.credit_cents - totals.debit_cents
+        else:
+            return totals.debit_cents - totals.credit_cents
+
+    def balance_cents_at(self, moment):
+        """The balance of the account just before `moment`.
+
+        A `date` means the end of that day in the tenant's payments timezone, so
+        `balance_cents_at(date(2025, 12, 31))` is the closing balance of 2025.
+        Starts from the latest snapshot before `moment`, so only transactions
+        since then are summed; see `AccountBalanceSnapshot`.
+        """
+        if not isinstance(moment, datetime):
+            tz = zoneinfo.ZoneInfo(_tenant_payments_timezone())
+            moment = datetime.combine(moment + timedelta(days=1), datetime.min.time(), tzinfo=tz)
+        snapshot = (
+            self.balance_snapshots.filter(closed_at__lte=moment).order_by("-closed_at").first()
+        )
+        transactions = Transaction.objects.filter(created_at__lt=moment)
+        if snapshot is None:
+            snapshot = AccountBalanceSnapshot(account_id=self.pk)
+        else:
+            transactions = transactions.filter(created_at__gte=snapshot.closed_at)
+        credit_cents = (
+            snapshot.credit_cents
+            + transactions.filter(credit_account=self).aggregate(
+                total=Sum("amount_cents", default=0)
+            )["total"]
+        )
+        debit_cents = (
+            snapshot.debit_cents
+            + transactions.filter(debit_account=self).aggregate(
+                total=Sum("amount_cents", default=0)
+            )["total"]
+        )
         if self.credit_balance:
-            return credit_balance - debit_balance
+            return credit_cents - debit_cents
         else:
-            return debit_balance - credit_balance
+            return debit_cents - credit_cents
+
+
+# Account id -> [credit, debit] cents not yet added, inside AccountBalance.deferred
+_deferred_balances = ContextVar("deferred_balances", default=None)
+
+
+class AccountBalance(models.Model):
+    """The running credit and debit totals of an account.
+
+    Every transaction that is saved or bulk created adds to the totals of its
+    accounts in the same database transaction, so reading a balance is one row
+    instead of two sums over the journal. `verify_account_balances` checks the
+    totals against the journal.
+    """
+
+    # Like Transaction, not constrained, so totals of removed accounts remain
+    account = models.OneToOneField(
+        Account,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        primary_key=True,
+        related_name="balance",
+    )
+    credit_cents = models.BigIntegerField(default=0)
+    debit_cents = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"Balance of account {self.account_id}"
+
+    @classmethod
+    def add(cls, transactions):
+        """Add the amounts of new `transactions` to the totals of their accounts.
+
+        One statement updates all accounts involved, locking their rows in the
+        order of their account ids until the transaction ends. Transactions that
+        create several journal transactions should do so in `deferred`, so they
+        lock all their rows in that order too, and only at the end.
+        """
+        deltas = _deferred_balances.get()
+        deferring = deltas is not None
+        if not deferring:
+            deltas = defaultdict(lambda: [0, 0])
+        for t in transactions:
+            deltas[t.credit_account_id][0] += t.amount_cents
+            deltas[t.debit_account_id][1] += t.amount_cents
+        if not deferring:
+            cls._apply(deltas)
+
+    @classmethod
+    @contextmanager
+    def deferred(cls):
+        """Add the totals of transactions created inside at the end, in one statement.
+
+        Use it inside the database transaction, and don't roll back savepoints
+        in it that created journal transactions. Balances read inside include
+        the deferred amounts.
+
+        Writers that lock their balance rows one statement at a time, in
+        different orders, can deadlock, and hold busy rows such as accounts
+        receivable for their whole transaction.
+        """
+        if _deferred_balances.get() is not None:
+            yield
+            return
+        deltas = defaultdict(lambda: [0, 0])
+        token = _deferred_balances.set(deltas)
+        try:
+            yield
+        finally:
+            _deferred_balances.reset(token)
+        cls._apply(deltas)
+
+    @classmethod
+    def with_deferred(cls, balance):
+        """`balance` plus the amounts deferred for its account, if any."""
+        deltas = _deferred_balances.get()
+        if not deltas or balance.account_id not in deltas:
+            return balance
+        credit_cents, debit_cents = deltas[balance.account_id]
+        return cls(
+            account_id=balance.account_id,
+            credit_cents=balance.credit_cents + credit_cents,
+            debit_cents=balance.debit_cents + debit_cents,
+        )
+
+    @classmethod
+    def _apply(cls, deltas):
+        if not deltas:
+            return
+        rows = sorted(deltas.items())
+        table = cls._meta.db_table
+        values = ", ".join(["(%s, %s, %s)"] * len(rows))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                INSERT INTO {table} AS balance (account_id, credit_cents, debit_cents)
+                VALUES {values}
+                ON CONFLICT (account_id) DO UPDATE SET
+                    credit_cents = balance.credit_cents + EXCLUDED.credit_cents,
+                    debit_cents = balance.debit_cents + EXCLUDED.debit_cents
+                """,
+                [
+                    value
+                    for account_id, (credit, debit) in rows
+                    for value in (account_id, credit, debit)
+                ],
+            )
+
+    @classmethod
+    def from_journal(cls):
+        """The totals of every account as recomputed from all transactions, by account id."""
+        totals = defaultdict(lambda: cls(credit_cents=0, debit_cents=0))
+        for account_id, total in (
+            Transaction.objects.values("credit_account_id")
+            .annotate(total=models.Sum("amount_cents"))
+            .values_list("credit_account_id", "total")
+            .order_by()
+        ):
+            totals[account_id].credit_cents = total
+        for account_id, total in (
+            Transaction.objects.values("debit_account_id")
+            .annotate(total=models.Sum("amount_cents"))
+            .values_list("debit_account_id", "total")
+            .order_by()
+        ):
+            totals[account_id].debit_cents = total
+        for account_id, balance in totals.items():
+            balance.account_id = account_id
+        return dict(totals)
+
+
+def _month_start(moment, tz):
+    local = moment.astimezone(tz)
+    return datetime(local.year, local.month, 1, tzinfo=tz)
+
+
+def _next_month_start(month_start):
+    year, month = divmod(month_start.year * 12 + month_start.month, 12)
+    return month_start.replace(year=year, month=month + 1)
+
+
+class AccountBalanceSnapshot(models.Model):
+    """The credit and debit totals of an account when a month closed.
+
+    Months follow the tenant's payments timezone. Every snapshot is built from
+    the account's previous snapshot plus the transactions of that month, and
+    only for accounts that had transactions that month, so the latest snapshot
+    before a moment plus at most the transactions since its month closed give
+    the balance at that moment; see `Account.balance_cents_at`.
+    """
+
+    account = models.ForeignKey(
+        Account,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name="balance_snapshots",
+    )
+    # Transactions created before this moment are included
+    closed_at = models.DateTimeField()
+    credit_cents = models.BigIntegerField(default=0)
+    debit_cents = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["account", "closed_at"], name="accountbalancesnapshot_unique"
+            ),
+        ]
+
+    def __str__(self):
+        return f"Balance of account {self.account_id} at {self.closed_at}"
+
+    @classmethod
+    def periods_to_snapshot(cls, before, *, timezone=None):
+        """The (start, end) of every month without snapshots that ended by `before`."""
+        tz = zoneinfo.ZoneInfo(timezone or _tenant_payments_timezone())
+        last_closed_at = cls.objects.aggregate(last=models.Max("closed_at"))["last"]
+        if last_closed_at is None:
+            last_closed_at = Transaction.objects.aggregate(first=models.Min("created_at"))["first"]
+            if last_closed_at is None:
+                return
+        start = _month_start(last_closed_at, tz)
+        end = _next_month_start(start)
+        while end <= before:
+            yield start, end
+            start, end = end, _next_month_start(end)
+
+    @classmethod
+    def create_for_period(cls, start, end):
+        """Snapshot, at `end`, every account with transactions between `start` and `end`."""
+        totals = defaultdict(lambda: [0, 0])
+        transactions = Transaction.objects.filter(created_at__gte=start, created_at__lt=end)
+        for side, index in (("credit_account_id", 0), ("debit_account_id", 1)):
+            for account_id, total in (
+                transactions.values(side)
+                .annotate(total=Sum("amount_cents"))
+                .values_list(side, "total")
+                .order_by()
+            ):
+                totals[account_id][index] = total
+        if not totals:
+            return []
+        previous = {
+            snapshot.account_id: snapshot
+            for snapshot in cls.objects.filter(account_id__in=totals, closed_at__lte=start)
+            .order_by("account_id", "-closed_at")
+            .distinct("account_id")
+        }
+        snapshots = []
+        for account_id, (credit_cents, debit_cents) in totals.items():
+            before = previous.get(account_id, cls())
+            snapshots.append(
+                cls(
+                    account_id=account_id,
+                    closed_at=end,
+                    credit_cents=before.credit_cents + credit_cents,
+                    debit_cents=before.debit_cents + debit_cents,
+                )
+            )
+        return cls.objects.bulk_create(snapshots, ignore_conflicts=True)
 
 
 class ProductType(models.TextChoices):
@@ -394,6 +716,77 @@ class OrderManager(models.Manager):
         obligation = order.get_or_create_next_payment_obligation(timezone=timezone)
         return order, obligation
 
+    def create_next_payment_obligations(self, orders, *, timezone=None, now: datetime = None):
+        """`Order.get_or_create_next_payment_obligation` for a batch of orders at once.
+
+        The next period of every order is worked out in memory, after which the
+        new transactions, obligations and member credit payments are written
+        with a handful of bulk queries. Returns the obligation of every order
+        that isn't cancelled, in the order of `orders`.
+
+        Everything is written in one savepoint. When another caller created one
+        of the obligations first, the unique constraint fails the whole batch
+        with an IntegrityError; fall back to the per-order method then.
+        """
+        from symfexit.payments.services import apply_member_credit_in_bulk  # noqa: PLC0415
+
+        orders = [order for order in orders if order.cancelled_at is None]
+        if not orders:
+            return []
+        if timezone is None:
+            timezone = _tenant_payments_timezone()
+        timezone = zoneinfo.ZoneInfo(timezone)
+        if now is None:
+            now = datetime.now(tz=timezone)
+
+        latest = {
+            obligation.order_id: obligation
+            for obligation in PaymentObligation.objects.filter(order__in=orders)
+            .order_by("order_id", "-year", "-period")
+            .distinct("order_id")
+        }
+        ar_account, _ = Account.get_accounts_receivable_account()
+        revenue_account, _ = Account.get_revenue_account()
+        obligations = []
+        created = []
+        next_due_at = []
+        for order in orders:
+            previous_obligation = latest.get(order.id)
+            year, period = order._next_obligation_period(previous_obligation, now)
+            if previous_obligation is not None and (year, period) == (
+                previous_obligation.year,
+                previous_obligation.period,
+            ):
+                obligation = previous_obligation
+            else:
+                obligation = PaymentObligation(
+                    order=order,
+                    year=year,
+                    period=period,
+                    pay_before=order._pay_before(year, period, timezone=timezone),
+                    amount_euros=order.product_price_euros,
+                    settled=order.product_price_euros <= 0,
+                    ordered_for_billing_address_id=order.ordered_for_billing_address_id,
+                    transaction=Transaction(
+                        credit_account=revenue_account,
+                        debit_account=ar_account,
+                        amount_cents=order.product_price_cents(),
+                    ),
+                )
+                created.append(obligation)
+            obligations.append(obligation)
+            next_due_at.append(order._period_end(year, period, timezone=timezone))
+
+        with transaction.atomic(), AccountBalance.deferred():
+            Transaction.objects.bulk_create([obligation.transaction for obligation in created])
+            PaymentObligation.objects.bulk_create(created)
+            apply_member_credit_in_bulk(created)
+            # Only now, so a failed batch leaves the orders as they were
+            for order, due_at in zip(orders, next_due_at, strict=True):
+                order.next_due_at = due_at
+            self.bulk_update(orders, ["next_due_at"])
+        return obligations
+
 
 class Order(models.Model):
     # For now only one order item per order is possible
@@ -418,8 +811,21 @@ class Order(models.Model):
 
     paid_using = models.ForeignKey("PaymentProvider", on_delete=models.SET_NULL, null=True)
 
+    # Maintained by get_or_create_next_payment_obligation, so gen_obligations
+    # only has to look at orders that are due. Empty when not known yet.
+    next_due_at = models.DateTimeField(_("next obligation due at"), null=True, editable=False)
+
     objects = OrderManager()
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["next_due_at"],
+                name="order_next_due_at_idx",
+                condition=Q(subscription__isnull=False, cancelled_at__isnull=True),
+            ),
+        ]
+
     def __str__(self):
         if self.ordered_for:
             return (
@@ -476,6 +882,45 @@ class Order(models.Model):
             case PeriodUnit.YEAR:
                 return datetime(year, 1, 1, tzinfo=timezone)
 
+    def _next_obligation_period(self, previous_obligation, now: datetime):
+        """The (year, period) of the obligation that should exist after `previous_obligation`.
+
+        That is `previous_obligation`'s own period while `now` is not past it yet.
+        """
+        if previous_obligation is None:
+            next_period, next_year = self._get_period_initial()
+            return next_year, next_period
+        previous = (previous_obligation.year, previous_obligation.period)
+        if previous >= self._get_current_period(now):
+            return previous
+        return self._calculate_next_period(*previous)
+
+    def _pay_before(self, year: int, period: int, *, timezone: zoneinfo.ZoneInfo):
+        """The last moment of `period`, by which its obligation must be paid."""
+        return self._period_to_datetime(
+            *self._calculate_next_period(year, period),
+            timezone=timezone,
+        ) - timedelta(seconds=1)
+
+    def _period_end(self, year: int, period: int, *, timezone: zoneinfo.ZoneInfo):
+        """The start of the period of one unit after `period`.
+
+        From then on `_get_current_period` is past `period`, so an order whose
+        latest obligation is for `period` is due for its next one.
+        """
+        match self.subscription_period_unit:
+            case PeriodUnit.DAY:
+                return datetime(year, 1, 1, tzinfo=timezone) + timedelta(days=period + 1)
+            case PeriodUnit.WEEK:
+                monday = date.fromisocalendar(year, period + 1, 1) + timedelta(weeks=1)
+                return datetime(monday.year, monday.month, monday.day, tzinfo=timezone)
+            case PeriodUnit.MONTH:
+                return datetime(
+                    year + (period + 1) // 12, (period + 1) % 12 + 1, 1, tzinfo=timezone
+                )
+            case PeriodUnit.YEAR:
+                return datetime(year + 1, 1, 1, tzinfo=timezone)
+
     def _calculate_next_period(self, previous_year: int, previous_period: int):
         if self.subscription_period_unit == PeriodUnit.YEAR:
             # Special case: years don't wrap within a year
@@ -501,26 +946,8 @@ class Order(models.Model):
         if now is None:
             now = datetime.now(tz=timezone)
         previous_obligation = self.paymentobligation_set.order_by("-year", "-period").first()
-        # Define period extractors and limits for each unit
-
-        if previous_obligation is None:
-            next_period, next_year = self._get_period_initial()
-        else:
-            previous_period = previous_obligation.period
-            previous_year = previous_obligation.year
-            current_period = self._get_current_period(now)
-
-            if (previous_year, previous_period) >= current_period:
-                next_period = previous_period
-                next_year = previous_year
-            else:
-                next_year, next_period = self._calculate_next_period(previous_year, previous_period)
-
-        # Convert the year and period to a pay_before datetime
-        pay_before = self._period_to_datetime(
-            *self._calculate_next_period(next_year, next_period),
-            timezone=timezone,
-        ) - timedelta(seconds=1)
+        next_year, next_period = self._next_obligation_period(previous_obligation, now)
+        pay_before = self._pay_before(next_year, next_period, timezone=timezone)
 
         obligation = self.paymentobligation_set.filter(year=next_year, period=next_period).first()
         if obligation is None:
@@ -547,11 +974,41 @@ class Order(models.Model):
                 # Another caller won the race for this (order, year, period).
                 # Re-fetch and use theirs; skip apply_member_credit since the
                 # winner will have run it.
-                return self.paymentobligation_set.get(year=next_year, period=next_period)
-            apply_member_credit(obligation)
+                obligation = self.paymentobligation_set.get(year=next_year, period=next_period)
+            else:
+                apply_member_credit(obligation)
+
+        # The obligation is the latest one of this order now
+        next_due_at = self._period_end(obligation.year, obligation.period, timezone=timezone)
+        if next_due_at != self.next_due_at:
+            self.next_due_at = next_due_at
+            Order.objects.filter(pk=self.pk).update(next_due_at=next_due_at)
         return obligation
 
 
+class PaymentObligationQuerySet(models.QuerySet):
+    def with_outstanding(self):
+        """Annotate `paid_cents` and `outstanding_cents` with a subquery.
+
+        `outstanding_cents` then comes from the annotation instead of a query per
+        obligation. It is read when the queryset is, so re-fetch an obligation
+        before relying on it after adding a payment.
+        """
+        paid = (
+            Payment.objects.filter(obligation=OuterRef("pk"))
+            .order_by()
+            .values("obligation")
+            .annotate(total=Sum("transaction__amount_cents"))
+            .values("total")
+        )
+        return self.annotate(
+            paid_cents=Coalesce(Subquery(paid, output_field=models.IntegerField()), 0),
+        ).annotate(
+            outstanding_cents=Cast(F("amount_euros") * 100, models.IntegerField())
+            - F("paid_cents"),
+        )
+
+
 class PaymentObligation(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE)
     transaction = models.OneToOneField(Transaction, on_delete=models.PROTECT)
@@ -563,6 +1020,14 @@ class PaymentObligation(models.Model):
     ordered_for_billing_address = models.ForeignKey(
         BillingAddress, on_delete=models.PROTECT, null=False, blank=False
     )
+    # Whether payments cover the amount. Kept up to date by save() and
+    # update_settled(), so charging only has to look at unsettled obligations.
+    settled = models.BooleanField(_("settled"), default=False, editable=False)
+
+    objects = PaymentObligationQuerySet.as_manager()
+
+    # Set by PaymentObligationQuerySet.with_outstanding
+    _outstanding_cents = None
 
     class Meta:
         constraints = [
@@ -571,6 +1036,13 @@ class PaymentObligation(models.Model):
                 name="paymentobligation_unique_per_period",
             ),
         ]
+        indexes = [
+            models.Index(
+                fields=["id"],
+                name="paymentobligation_unsettled_idx",
+                condition=Q(settled=False),
+            ),
+        ]
 
     def __str__(self):
         return f"Payment obligation for order {self.order.id} for year {self.year} {self.order.subscription_period_unit} {self.period + 1}"
@@ -578,8 +1050,16 @@ class PaymentObligation(models.Model):
     def save(self, *args, **kwargs):
         if self.amount_euros is None:
             self.amount_euros = self.order.product_price_euros
+        # The amount may have changed; a new obligation has no payments yet
+        self.settled = self.is_fully_paid if self.pk else self.amount_euros <= 0
         super().save(*args, **kwargs)
 
+    def update_settled(self):
+        """Store whether the obligation is paid, after a payment for it was added or deleted."""
+        self._outstanding_cents = None
+        self.settled = self.is_fully_paid
+        PaymentObligation.objects.filter(pk=self.pk).update(settled=self.settled)
+
     @property
     def eid(self):
         return hashids.encode(self.id)
@@ -588,6 +1068,8 @@ class PaymentObligation(models.Model):
 
     @property
     def outstanding_cents(self) -> int:
+        if self._outstanding_cents is not None:
+            return self._outstanding_cents
         obligation_cents = int(self.amount_euros * 100)
         paid_cents = (
             Payment.objects.filter(obligation=self)
@@ -597,6 +1079,10 @@ class PaymentObligation(models.Model):
         )
         return obligation_cents - paid_cents
 
+    @outstanding_cents.setter
+    def outstanding_cents(self, value):
+        self._outstanding_cents = value
+
     @property
     def is_fully_paid(self) -> bool:
         return self.outstanding_cents <= 0
@@ -604,7 +1090,13 @@ class PaymentObligation(models.Model):
     @classmethod
     def get_or_404(cls, eid) -> Subscription:
         id = hashids.decode(eid)[0]
-        return get_object_or_404(PaymentObligation, id=id)
+        return get_object_or_404(PaymentObligation.objects.with_outstanding(), id=id)
+
+
+@receiver(post_delete, sender=PaymentObligation)
+def reset_next_due_at(sender, instance, **kwargs):
+    # The order may be due again for the deleted period
+    Order.objects.filter(pk=instance.order_id).update(next_due_at=None)
 
 
 class Payment(models.Model):
@@ -620,6 +1112,14 @@ class Payment(models.Model):
         return f"Payment for order {self.obligation.order.id} made at {date_format(self.paid_at, 'DATETIME_FORMAT')}"
 
 
+@receiver(post_delete, sender=Payment)
+def reset_settled(sender, instance, **kwargs):
+    # The obligation may no longer be paid without this payment
+    obligation = PaymentObligation.objects.filter(pk=instance.obligation_id).first()
+    if obligation is not None:
+        obligation.update_settled()
+
+
 class PaymentProvider(models.Model):
     name = models.CharField(max_length=100, default="")
     type = models.CharField(max_length=100)
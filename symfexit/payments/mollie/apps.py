@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class PaymentsMollieConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "symfexit.payments.mollie"
+
+    def ready(self):
+        from symfexit.payments.mollie.models import MollieSettings  # noqa: PLC0415
+        from symfexit.worker import tenantcache  # noqa: PLC0415
+
+        tenantcache.invalidate_on_change(MollieSettings)
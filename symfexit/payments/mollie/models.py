@@ -58,7 +58,16 @@ class MollieCustomer(models.Model):
         return f"Mollie customer {self.mollie_customer_id} for {self.user}"
 
 
+class MolliePaymentQuerySet(models.QuerySet):
+    def pending(self):
+        """Payments that don't have a final status yet, so may still be paid."""
+        return self.filter(status__in=MolliePayment.PENDING_STATUSES)
+
+
 class MolliePayment(models.Model):
+    # Mollie statuses after which a payment can still become paid
+    PENDING_STATUSES = ("open", "pending", "authorized")
+
     obligation = models.ForeignKey(
         "payments.PaymentObligation",
         on_delete=models.CASCADE,
@@ -70,5 +79,7 @@ class MolliePayment(models.Model):
     status = models.CharField(max_length=50, default="open")
     processed_at = models.DateTimeField(null=True, blank=True)
 
+    objects = MolliePaymentQuerySet.as_manager()
+
     def __str__(self):
         return f"Mollie payment {self.mollie_payment_id} ({self.status})"
@@ -1,19 +1,27 @@
 import logging
 
+from django.db import transaction
+from django.db.models import Exists, OuterRef
 from django.http import HttpResponseRedirect
 from django.urls import reverse
 from mollie.api.client import Client
 from mollie.api.objects.customer import Customer as MollieApiCustomer
 
+from symfexit.payments.models import PaymentObligation
 from symfexit.payments.mollie.admin import MollieSettingsInline
 from symfexit.payments.mollie.models import MollieCustomer, MolliePayment, MollieSettings
 from symfexit.payments.mollie.views import build_pending_url
 from symfexit.payments.registry import PaymentProcessor, PaymentProcessorInstance, payments_registry
+from symfexit.worker import ratelimit
+from symfexit.worker.ratelimit import RateLimit
 
 logger = logging.getLogger(__name__)
 
 MOLLIE_NAME = "mollie"
 
+# Shared by all workers, to stay well below Mollie's API rate limits
+MOLLIE_API_RATE_LIMIT = RateLimit("mollie_api", rate=10, burst=20)
+
 
 def _get_or_create_mollie_customer(client, user):
     try:
@@ -90,6 +98,11 @@ class MollieProcessor(PaymentProcessor):
     def get_settings_inline(self):
         return MollieSettingsInline
 
+    def without_pending_charges(self, obligations):
+        return obligations.exclude(
+            Exists(MolliePayment.objects.pending().filter(obligation=OuterRef("pk")))
+        )
+
     def get_instance(self, provider):
         return MollieProcessorInstance(provider.mollie_settings)
 
@@ -166,8 +179,23 @@ class MollieProcessorInstance(PaymentProcessorInstance):
         return HttpResponseRedirect(payment.checkout_url)
 
     def charge_obligation(self, obligation):
+        with transaction.atomic():
+            # The obligation may have been read, with its outstanding amount,
+            # before payments came in. Lock it like record_receipt does and
+            # recompute, so a payment can't slip in before the charge is made.
+            obligation = (
+                PaymentObligation.objects.select_for_update(of=("self",))
+                .select_related("order__ordered_for")
+                .get(pk=obligation.pk)
+            )
+            return self._charge_locked_obligation(obligation)
+
+    def _charge_locked_obligation(self, obligation):
         if obligation.is_fully_paid:
             return False
+        # A SEPA charge stays pending for days; charging again would double it
+        if obligation.mollie_payments.pending().exists():
+            return False
 
         user = obligation.order.ordered_for
 
@@ -178,6 +206,7 @@ class MollieProcessorInstance(PaymentProcessorInstance):
 
         client = self.mollie_settings.get_mollie_client()
 
+        ratelimit.acquire(MOLLIE_API_RATE_LIMIT)
         api_customer = client.customers.get(mollie_customer.mollie_customer_id)
         if not _has_valid_mandate(api_customer):
             return False
@@ -188,6 +217,7 @@ class MollieProcessorInstance(PaymentProcessorInstance):
         amount_str = f"{obligation.outstanding_cents / 100:.2f}"
         description = self.mollie_settings.format_description(obligation)
 
+        ratelimit.acquire(MOLLIE_API_RATE_LIMIT)
         payment = client.payments.create(
             {
                 "amount": {
@@ -3,22 +3,30 @@ from datetime import timedelta
 from django.utils import timezone
 
 from symfexit.payments.mollie.models import MolliePayment
+from symfexit.payments.mollie.payments import MOLLIE_API_RATE_LIMIT
 from symfexit.payments.mollie.views import _refresh_from_mollie
-from symfexit.worker import logger
-from symfexit.worker.registry import task_registry
+from symfexit.worker import logger, ratelimit
+from symfexit.worker.registry import RetryPolicy, Schedule, task_registry
 
 RECONCILE_THRESHOLD = timedelta(minutes=5)
 
 
-@task_registry.register("reconcile_mollie_payments")
+@task_registry.register(
+    "reconcile_mollie_payments",
+    retry=RetryPolicy(max_retries=5, delay=timedelta(minutes=1)),
+    schedule=Schedule(every=timedelta(minutes=15)),
+)
 def reconcile_mollie_payments():
-    """Pull status from Mollie for any MolliePayment still 'open' past the
+    """Pull status from Mollie for any MolliePayment still pending past the
     threshold. Catches missed webhooks where the customer paid at Mollie but
     we never heard about it (because delivery failed and they didn't return
-    to the pending page)."""
+    to the pending page). Pending payments also keep `charge_obligations`
+    from charging their obligation again."""
     cutoff = timezone.now() - RECONCILE_THRESHOLD
-    stale = MolliePayment.objects.filter(status="open", created_at__lt=cutoff).select_related(
-        "obligation__order__paid_using__mollie_settings"
+    stale = (
+        MolliePayment.objects.pending()
+        .filter(created_at__lt=cutoff)
+        .select_related("obligation__order__paid_using__mollie_settings")
     )
 
     refreshed = 0
@@ -26,6 +34,7 @@ def reconcile_mollie_payments():
 
     for mp in stale.iterator():
         try:
+            ratelimit.acquire(MOLLIE_API_RATE_LIMIT)
             _refresh_from_mollie(mp)
             refreshed += 1
         except Exception:
@@ -686,6 +686,58 @@ class ChargeObligationsTest(TestCase):
         self.assertFalse(MolliePayment.objects.exists())
         mock_client.payments.create.assert_not_called()
 
+    def test_skips_obligation_with_pending_charge(self):
+        from symfexit.payments.mollie.payments import MollieProcessorInstance  # noqa: PLC0415
+        from symfexit.payments.tasks import charge_obligations  # noqa: PLC0415
+
+        MollieCustomer.objects.create(user=self.user, mollie_customer_id="cst_pending")
+        MolliePayment.objects.create(
+            obligation=self.obligation, mollie_payment_id="tr_pending", status="pending"
+        )
+
+        mock_client = MagicMock()
+        mock_client.customers.get.return_value.mandates.list.return_value = _make_mock_mandates(
+            [{"status": "valid"}]
+        )
+        with patch.object(MollieSettings, "get_mollie_client", return_value=mock_client):
+            charge_obligations()
+            # Also when the obligation was selected before the charge was made
+            instance = MollieProcessorInstance(self.mollie_settings)
+            self.assertFalse(instance.charge_obligation(self.obligation))
+
+        mock_client.payments.create.assert_not_called()
+
+    def test_recomputes_outstanding_before_charging(self):
+        """A payment that came in after the obligation was read is not charged again."""
+        from symfexit.payments.models import PaymentObligation, Transaction  # noqa: PLC0415
+        from symfexit.payments.mollie.payments import MollieProcessorInstance  # noqa: PLC0415
+
+        MollieCustomer.objects.create(user=self.user, mollie_customer_id="cst_late")
+        stale = PaymentObligation.objects.with_outstanding().get(pk=self.obligation.pk)
+        self.assertFalse(stale.is_fully_paid)
+
+        ar_account, _ = Account.get_accounts_receivable_account()
+        bank_account, _ = Account.get_bank_account()
+        tx = Transaction.objects.create(
+            credit_account=ar_account, debit_account=bank_account, amount_cents=1000
+        )
+        Payment.objects.create(
+            obligation=self.obligation,
+            paid_using=self.provider,
+            paid_at=timezone.now(),
+            transaction=tx,
+        )
+
+        mock_client = MagicMock()
+        mock_client.customers.get.return_value.mandates.list.return_value = _make_mock_mandates(
+            [{"status": "valid"}]
+        )
+        with patch.object(MollieSettings, "get_mollie_client", return_value=mock_client):
+            instance = MollieProcessorInstance(self.mollie_settings)
+            self.assertFalse(instance.charge_obligation(stale))
+
+        mock_client.payments.create.assert_not_called()
+
     def test_skips_cancelled_orders(self):
         from django.utils import timezone as tz  # noqa: PLC0415
 
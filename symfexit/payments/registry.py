@@ -3,6 +3,7 @@ import bisect
 import logging
 
 import symfexit
+from symfexit.worker import tenantcache
 
 logger = logging.getLogger(__name__)
 
@@ -41,18 +42,28 @@ class PaymentsRegistry:
         raise RuntimeError("No available payment processor found")
 
     def get_instance_for_provider(self, provider: symfexit.payments.models.PaymentProvider):
+        key = f"payment_processor_instance:{provider.pk}"
+        instance = tenantcache.get(key)
+        if instance is not None:
+            return instance
         processor = self.get(provider.type)
         if not processor:
             raise RuntimeError(f"Payment processor {provider.type} not found in registry")
-        return processor.get_instance(provider)
+        instance = processor.get_instance(provider)
+        tenantcache.store(key, instance)
+        return instance
 
     def get_default_provider(self):
         from symfexit.payments.models import PaymentProvider  # noqa: PLC0415
 
+        provider = tenantcache.get("default_payment_provider")
+        if provider is not None:
+            return provider
         provider = PaymentProvider.objects.filter(default=True, enabled=True).first()
         if not provider:
             # TODO: Default to highest priority?
             raise RuntimeError("No default payment provider configured")
+        tenantcache.store("default_payment_provider", provider)
         return provider
 
     def initialize(self):
@@ -95,6 +106,10 @@ class PaymentProcessor(metaclass=abc.ABCMeta):
         """Returns an optional admin inline for the settings of this payment processor."""
         return None
 
+    def without_pending_charges(self, obligations):
+        """Returns the `obligations` without a charge of this processor that may still be paid."""
+        return obligations
+
     @abc.abstractmethod
     def get_instance(
         self, provider: symfexit.payments.models.PaymentProvider
@@ -116,6 +131,7 @@ class PaymentProcessorInstance(metaclass=abc.ABCMeta):
         """Attempt to charge an unpaid obligation automatically (recurring).
 
         Returns True if a charge was initiated, False if skipped (e.g. no mandate).
-        Raises on error.
+        Raises on error. The obligation may be stale: lock it and recompute what
+        is outstanding before charging.
         """
         return False
@@ -4,7 +4,13 @@ from django.contrib.auth import get_user_model
 from django.db import transaction
 from django.utils import timezone
 
-from symfexit.payments.models import Account, Payment, PaymentObligation, Transaction
+from symfexit.payments.models import (
+    Account,
+    AccountBalance,
+    Payment,
+    PaymentObligation,
+    Transaction,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -26,7 +32,7 @@ def reconcile_signup_overpayment_to_user(order, user) -> int:
     """
     ar_account, _ = Account.get_accounts_receivable_account()
     moved_cents = 0
-    for obligation in order.paymentobligation_set.all():
+    for obligation in order.paymentobligation_set.with_outstanding():
         outstanding = obligation.outstanding_cents
         if outstanding >= 0:
             continue
@@ -53,7 +59,7 @@ def apply_member_credit(obligation: PaymentObligation) -> Payment | None:
         return None
 
     ar_account, _ = Account.get_accounts_receivable_account()
-    with transaction.atomic():
+    with transaction.atomic(), AccountBalance.deferred():
         # Lock the user row so concurrent callers (cron + webhook + admin)
         # serialize on the same credit balance and can't both consume it.
         locked_user = User.objects.select_for_update().get(pk=user.pk)
@@ -73,9 +79,60 @@ def apply_member_credit(obligation: PaymentObligation) -> Payment | None:
             paid_at=timezone.now(),
             transaction=tx,
         )
+        obligation.update_settled()
     return payment
 
 
+def apply_member_credit_in_bulk(obligations) -> list[Payment]:
+    """`apply_member_credit` for many new obligations, which have no payments yet.
+
+    The users are locked and their credit balances read in one go. A user with
+    several of the obligations spends their credit on them in the given order.
+    """
+    user_ids = {obligation.order.ordered_for_id for obligation in obligations}
+    with transaction.atomic():
+        users = {
+            user.pk: user
+            for user in User.objects.select_for_update()
+            .filter(pk__in=user_ids, credit_account__isnull=False)
+            .order_by("pk")
+        }
+        if not users:
+            return []
+        balances = Account.balances_cents([user.credit_account_id for user in users.values()])
+        ar_account, _ = Account.get_accounts_receivable_account()
+        paid_at = timezone.now()
+        payments = []
+        for obligation in obligations:
+            user = users.get(obligation.order.ordered_for_id)
+            if user is None:
+                continue
+            outstanding_cents = int(obligation.amount_euros * 100)
+            apply_cents = min(balances[user.credit_account_id], outstanding_cents)
+            if apply_cents <= 0:
+                continue
+            balances[user.credit_account_id] -= apply_cents
+            obligation.settled = apply_cents == outstanding_cents
+            payments.append(
+                Payment(
+                    obligation=obligation,
+                    paid_using_id=obligation.order.paid_using_id,
+                    paid_at=paid_at,
+                    transaction=Transaction(
+                        credit_account=ar_account,
+                        debit_account_id=user.credit_account_id,
+                        amount_cents=apply_cents,
+                    ),
+                )
+            )
+        Transaction.objects.bulk_create([payment.transaction for payment in payments])
+        Payment.objects.bulk_create(payments)
+        PaymentObligation.objects.filter(
+            pk__in=[payment.obligation.pk for payment in payments if payment.obligation.settled]
+        ).update(settled=True)
+    return payments
+
+
 def record_receipt(obligation: PaymentObligation, amount_cents: int) -> Payment | None:
     """Apply a received payment to its obligation; bank any surplus in the
     member's credit account.
@@ -97,7 +154,7 @@ def record_receipt(obligation: PaymentObligation, amount_cents: int) -> Payment
 
     ar_account, _ = Account.get_accounts_receivable_account()
 
-    with transaction.atomic():
+    with transaction.atomic(), AccountBalance.deferred():
         # Lock the obligation row so concurrent receipts (e.g. two distinct
         # MolliePayments racing, or webhook + manual admin entry) read a
         # consistent `outstanding_cents` and don't double-apply.
@@ -135,6 +192,7 @@ def record_receipt(obligation: PaymentObligation, amount_cents: int) -> Payment
                 paid_at=timezone.now(),
                 transaction=tx,
             )
+            locked_obligation.update_settled()
 
         if surplus > 0:
             credit_account = user.get_or_create_credit_account()
@@ -1,17 +1,65 @@
 import zoneinfo
-from datetime import date, datetime, time
+from datetime import UTC, date, datetime, time, timedelta
 
-from django.db import connection
+from django.db import connection, transaction
+from django.db.models import Q
 
-from symfexit.payments.models import Order, PaymentObligation
+from symfexit.payments.models import AccountBalanceSnapshot, Order, PaymentObligation
 from symfexit.payments.registry import payments_registry
 from symfexit.worker import logger
-from symfexit.worker.registry import task_registry
-
-
-@task_registry.register("gen_obligations")
+from symfexit.worker.chunks import run_in_chunks
+from symfexit.worker.registry import (
+    DuplicateTask,
+    RetryPolicy,
+    Schedule,
+    add_task,
+    task_registry,
+)
+from symfexit.worker.subtasks import add_subtasks, id_ranges, in_range
+
+# Billing runs over more rows than this are split into sub-tasks of this size
+CHUNK_SIZE = 500
+# Billing tasks commit their work, and their progress, every this many rows
+COMMIT_SIZE = 100
+
+
+@task_registry.register(
+    "billing_pipeline",
+    queue="billing",
+    schedule=Schedule(every=timedelta(days=1), offset=timedelta(hours=1)),
+)
+def billing_pipeline():
+    """Generate obligations, then charge them, then reconcile the payments.
+
+    Every step is queued as soon as the one before has completed, and isn't
+    run when it failed.
+    """
+    try:
+        generate = add_task("gen_obligations", dedupe_key="gen_obligations")
+    except DuplicateTask as e:
+        generate = e.task
+    try:
+        charge = add_task(
+            "charge_obligations", depends_on=[generate], dedupe_key="charge_obligations"
+        )
+    except DuplicateTask:
+        logger.log("Obligations are already being charged")
+        return
+    # Only registered when Mollie payments are installed
+    if "reconcile_mollie_payments" in task_registry:
+        add_task("reconcile_mollie_payments", depends_on=[charge])
+    logger.log(f"Queued the billing pipeline, starting with task {generate.id}")
+
+
+@task_registry.register(
+    "gen_obligations",
+    queue="billing",
+    atomic=False,
+    exclusive=True,
+    retry=RetryPolicy(max_retries=3, delay=timedelta(minutes=5)),
+)
 def gen_obligations(now=None):
-    """Generate the next payment obligation for every active subscription order.
+    """Generate the next payment obligation for every active subscription order that is due.
 
     `now` is an optional override for "current time" — useful for backdating or
     forward-dating runs. Accepts a `date` (interpreted as start-of-day in the
@@ -29,62 +77,163 @@ def gen_obligations(now=None):
         elif isinstance(now, date):
             now = datetime.combine(now, time.min, tzinfo=tz)
 
-    orders = Order.objects.filter(
+    orders = _due_orders(now)
+    ranges = id_ranges(orders, CHUNK_SIZE)
+    if len(ranges) <= 1:
+        return _gen_obligations(orders, timezone_name, now)
+    add_subtasks("gen_obligations_chunk", [((start, stop), {"now": now}) for start, stop in ranges])
+    logger.log(f"Split {orders.count()} orders over {len(ranges)} sub-tasks")
+    return None
+
+
+@task_registry.register(
+    "gen_obligations_chunk",
+    queue="billing",
+    atomic=False,
+    retry=RetryPolicy(max_retries=3, delay=timedelta(minutes=5)),
+)
+def gen_obligations_chunk(start, stop, now=None):
+    orders = in_range(_due_orders(now), start, stop)
+    return _gen_obligations(orders, connection.tenant.payments_timezone, now)
+
+
+def _due_orders(now=None):
+    """Active subscription orders that may be due for their next obligation."""
+    return Order.objects.filter(
+        Q(next_due_at__isnull=True) | Q(next_due_at__lte=now or datetime.now(tz=UTC)),
         subscription__isnull=False,
         cancelled_at__isnull=True,
     )
 
-    created = 0
-    errors = 0
 
-    for order in orders.iterator():
+def _gen_obligations(orders, timezone_name, now):
+    def handle(chunk):
         try:
-            order.get_or_create_next_payment_obligation(timezone=timezone_name, now=now)
-            created += 1
+            with transaction.atomic():
+                Order.objects.create_next_payment_obligations(
+                    chunk, timezone=timezone_name, now=now
+                )
         except Exception as e:
-            errors += 1
-            logger.log(f"Order {order.id}: ERROR - {e}")
-
-    logger.log(f"Processed {created} orders, {errors} errors")
-
-
-@task_registry.register("charge_obligations")
+            # Find the failing orders, or let racing obligations win, one by one
+            logger.log(f"Orders {chunk[0].id}-{chunk[-1].id}: bulk generation failed ({e})")
+        else:
+            return {"created": len(chunk), "errors": 0}
+
+        created = 0
+        errors = 0
+        for order in chunk:
+            try:
+                # A failing order must not break the chunk's transaction
+                with transaction.atomic():
+                    order.get_or_create_next_payment_obligation(timezone=timezone_name, now=now)
+                created += 1
+            except Exception as e:
+                errors += 1
+                logger.log(f"Order {order.id}: ERROR - {e}")
+        return {"created": created, "errors": errors}
+
+    totals = run_in_chunks(orders, COMMIT_SIZE, handle)
+    logger.log(f"Processed {totals.get('created', 0)} orders, {totals.get('errors', 0)} errors")
+    return totals
+
+
+@task_registry.register(
+    "charge_obligations",
+    queue="billing",
+    atomic=False,
+    exclusive=True,
+)
 def charge_obligations():
-    # Note: no payment__isnull=True filter — an obligation can have a credit-funded
-    # Payment that still leaves an outstanding amount, which we want to charge here.
-    # The processor's charge_obligation must short-circuit on is_fully_paid.
-    obligations = PaymentObligation.objects.filter(
+    # Note: filter on settled, not payment__isnull=True — an obligation can have a
+    # credit-funded Payment that still leaves an outstanding amount, which we want
+    # to charge here. The processor's charge_obligation must still recompute
+    # is_fully_paid on the locked obligation, as a payment may have come in since
+    # the flag, or the outstanding amount annotated per chunk, was read.
+    obligations = _chargeable_obligations()
+    ranges = id_ranges(obligations, CHUNK_SIZE)
+    if len(ranges) <= 1:
+        return _charge_obligations(obligations)
+    add_subtasks("charge_obligations_chunk", [((start, stop), {}) for start, stop in ranges])
+    logger.log(f"Split {obligations.count()} obligations over {len(ranges)} sub-tasks")
+    return None
+
+
+# Limits the number of concurrent Mollie charges from one async worker
+@task_registry.register(
+    "charge_obligations_chunk", queue="billing", atomic=False, max_concurrency=4
+)
+def charge_obligations_chunk(start, stop):
+    return _charge_obligations(in_range(_chargeable_obligations(), start, stop))
+
+
+def _chargeable_obligations():
+    return PaymentObligation.objects.filter(
+        settled=False,
         order__paid_using__isnull=False,
         order__ordered_for__isnull=False,
         order__cancelled_at__isnull=True,
-    ).select_related(
-        "order__paid_using",
-        "order__ordered_for",
     )
 
-    charged = 0
-    skipped = 0
-    errors = 0
 
-    for obligation in obligations.iterator():
-        try:
-            if obligation.is_fully_paid:
-                skipped += 1
-                continue
-
-            provider = obligation.order.paid_using
-            processor = payments_registry.get(provider.type)
-            if processor is None:
-                skipped += 1
-                continue
-
-            instance = processor.get_instance(provider)
-            if instance.charge_obligation(obligation):
-                charged += 1
-            else:
-                skipped += 1
-        except Exception:
-            errors += 1
-            logger.log(f"Obligation {obligation.id}: ERROR")
-
-    logger.log(f"Charged {charged}, skipped {skipped}, errors {errors}")
+def _charge_obligations(obligations):
+    def handle(chunk):
+        charged = 0
+        skipped = 0
+        errors = 0
+        for obligation in chunk:
+            try:
+                if obligation.is_fully_paid:
+                    skipped += 1
+                    continue
+
+                provider = obligation.order.paid_using
+                processor = payments_registry.get(provider.type)
+                if processor is None:
+                    skipped += 1
+                    continue
+
+                instance = payments_registry.get_instance_for_provider(provider)
+                with transaction.atomic():
+                    if instance.charge_obligation(obligation):
+                        charged += 1
+                    else:
+                        skipped += 1
+            except Exception:
+                errors += 1
+                logger.log(f"Obligation {obligation.id}: ERROR")
+        return {"charged": charged, "skipped": skipped, "errors": errors}
+
+    # Skip obligations of which an earlier charge may still come through
+    for _, processor in payments_registry:
+        obligations = processor.without_pending_charges(obligations)
+    obligations = obligations.with_outstanding().select_related(
+        "order__paid_using",
+        "order__ordered_for",
+    )
+    totals = run_in_chunks(obligations, COMMIT_SIZE, handle)
+    logger.log(
+        f"Charged {totals.get('charged', 0)}, skipped {totals.get('skipped', 0)}, "
+        f"errors {totals.get('errors', 0)}"
+    )
+    return totals
+
+
+# Transactions are timestamped before they commit, so a month is only
+# snapshotted once a billing run that started before its end has committed
+SNAPSHOT_DELAY = timedelta(days=1)
+
+
+@task_registry.register(
+    "snapshot_balances",
+    queue="billing",
+    atomic=False,
+    exclusive=True,
+    schedule=Schedule(every=timedelta(days=1), offset=timedelta(hours=3)),
+)
+def snapshot_balances():
+    """Snapshot the account balances of every month that closed since the last snapshot."""
+    before = datetime.now(tz=UTC) - SNAPSHOT_DELAY
+    for start, end in AccountBalanceSnapshot.periods_to_snapshot(before):
+        with transaction.atomic():
+            snapshots = AccountBalanceSnapshot.create_for_period(start, end)
+        logger.log(f"Snapshotted {len(snapshots)} account balances at {end}")
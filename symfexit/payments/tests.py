@@ -1,14 +1,21 @@
-from datetime import UTC, datetime
+from contextlib import suppress
+from datetime import UTC, date, datetime, timedelta
 from decimal import Decimal
+from unittest.mock import patch
 from uuid import uuid4
 
+from django.db import IntegrityError, transaction
 from django.test import TestCase
 from django_tenants.test.cases import FastTenantTestCase
 
 from symfexit.members.admin import Member
 from symfexit.payments.models import (
+    ACCOUNT_WAIVED,
     Account,
+    AccountBalance,
+    AccountBalanceSnapshot,
     BillingAddress,
+    Order,
     PaymentObligation,
     PeriodUnit,
     Product,
@@ -16,7 +23,9 @@ from symfexit.payments.models import (
     Subscription,
     Transaction,
 )
-from symfexit.payments.tasks import gen_obligations
+from symfexit.payments.services import record_receipt
+from symfexit.payments.tasks import gen_obligations, snapshot_balances
+from symfexit.worker import tenantcache
 
 
 class TestBalance(TestCase):
@@ -67,6 +76,107 @@ class TestBalance(TestCase):
         self.assertEqual(bank_account.balance_cents(), -700)
         self.assertEqual(expenses_account.balance_cents(), 700)
 
+    def test_bulk_created_transactions_update_balances(self):
+        bank_account = Account.objects.create(
+            name="Bank", description="Balance at the bank", code=1, credit_balance=False
+        )
+        revenue_account, _ = Account.get_revenue_account()
+        Transaction.objects.bulk_create(
+            [
+                Transaction(
+                    credit_account=revenue_account,
+                    debit_account=bank_account,
+                    amount_cents=amount,
+                    part_of=uuid4(),
+                )
+                for amount in (300, 400)
+            ]
+        )
+        with self.assertNumQueries(1):
+            self.assertEqual(bank_account.balance_cents(), 700)
+        self.assertEqual(revenue_account.balance_cents(), 700)
+
+        expected = AccountBalance.from_journal()
+        for balance in AccountBalance.objects.all():
+            self.assertEqual(
+                (balance.credit_cents, balance.debit_cents),
+                (
+                    expected[balance.account_id].credit_cents,
+                    expected[balance.account_id].debit_cents,
+                ),
+            )
+
+    def test_deferred_balances_are_added_in_one_statement_at_the_end(self):
+        bank_account = Account.objects.create(
+            name="Bank", description="Balance at the bank", code=1, credit_balance=False
+        )
+        revenue_account, _ = Account.get_revenue_account()
+        with transaction.atomic(), AccountBalance.deferred():
+            for amount in (300, 400):
+                Transaction.objects.create(
+                    credit_account=revenue_account,
+                    debit_account=bank_account,
+                    amount_cents=amount,
+                    part_of=uuid4(),
+                )
+            self.assertFalse(AccountBalance.objects.filter(account=bank_account).exists())
+            # Reads include what is still deferred
+            self.assertEqual(bank_account.balance_cents(), 700)
+            self.assertEqual(
+                Account.balances_cents([revenue_account.id]), {revenue_account.id: 700}
+            )
+        self.assertEqual(AccountBalance.objects.get(account=bank_account).debit_cents, 700)
+
+        with suppress(ValueError), transaction.atomic(), AccountBalance.deferred():
+            Transaction.objects.create(
+                credit_account=revenue_account,
+                debit_account=bank_account,
+                amount_cents=100,
+                part_of=uuid4(),
+            )
+            raise ValueError
+        self.assertEqual(bank_account.balance_cents(), 700)
+
+
+class TestBalanceSnapshots(TestCase):
+    def test_balance_at_uses_snapshots(self):
+        bank_account = Account.objects.create(
+            name="Bank", description="Balance at the bank", code=1, credit_balance=False
+        )
+        revenue_account, _ = Account.get_revenue_account()
+        for created_at in (
+            datetime(2025, 11, 15, tzinfo=UTC),
+            datetime(2025, 12, 31, 23, tzinfo=UTC),
+            datetime(2026, 1, 10, tzinfo=UTC),
+        ):
+            entry = Transaction.objects.create(
+                credit_account=revenue_account,
+                debit_account=bank_account,
+                amount_cents=700,
+                part_of=uuid4(),
+            )
+            Transaction.objects.filter(id=entry.id).update(created_at=created_at)
+
+        snapshot_balances()
+
+        # Only months in which the account had transactions are snapshotted
+        self.assertEqual(
+            list(
+                AccountBalanceSnapshot.objects.filter(account=bank_account)
+                .order_by("closed_at")
+                .values_list("closed_at", "debit_cents")
+            ),
+            [
+                (datetime(2025, 12, 1, tzinfo=UTC), 700),
+                (datetime(2026, 1, 1, tzinfo=UTC), 1400),
+                (datetime(2026, 2, 1, tzinfo=UTC), 2100),
+            ],
+        )
+        self.assertEqual(bank_account.balance_cents_at(date(2025, 10, 31)), 0)
+        self.assertEqual(bank_account.balance_cents_at(date(2025, 12, 31)), 1400)
+        self.assertEqual(revenue_account.balance_cents_at(date(2025, 12, 31)), 1400)
+        self.assertEqual(bank_account.balance_cents_at(datetime(2026, 1, 10, 1, tzinfo=UTC)), 2100)
+
 
 class TestObligationOutstanding(TestCase):
     def setUp(self):
@@ -127,6 +237,18 @@ class TestObligationOutstanding(TestCase):
         self.assertEqual(self.obligation.outstanding_cents, -500)
         self.assertTrue(self.obligation.is_fully_paid)
 
+    def test_with_outstanding_annotates_in_one_query(self):
+        self._record_payment(400)
+        self._record_payment(100)
+
+        with self.assertNumQueries(1):
+            [obligation] = PaymentObligation.objects.filter(
+                pk=self.obligation.pk
+            ).with_outstanding()
+            self.assertEqual(obligation.paid_cents, 500)
+            self.assertEqual(obligation.outstanding_cents, 500)
+            self.assertFalse(obligation.is_fully_paid)
+
 
 class TestMemberCreditBalance(TestCase):
     def setUp(self):
@@ -215,6 +337,61 @@ class TestApplyMemberCredit(TestCase):
         obligation = no_user_order.get_or_create_next_payment_obligation(timezone="UTC")
         self.assertEqual(obligation.outstanding_cents, 1000)
 
+    def test_bulk_generation_matches_per_order(self):
+        other = self.product.order(for_user=self.user, billing_address=self.billing_address)
+        now = datetime(2099, 6, 15, tzinfo=UTC)
+
+        expected = other.get_or_create_next_payment_obligation(timezone="UTC", now=now)
+        [obligation] = Order.objects.create_next_payment_obligations(
+            [self.order], timezone="UTC", now=now
+        )
+
+        fields = ("year", "period", "pay_before", "amount_euros", "ordered_for_billing_address_id")
+        self.assertEqual(
+            [getattr(obligation, field) for field in fields],
+            [getattr(expected, field) for field in fields],
+        )
+        self.assertEqual(obligation.transaction.amount_cents, expected.transaction.amount_cents)
+        self.order.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.order.next_due_at, other.next_due_at)
+
+    def test_bulk_generation_spends_credit_in_order(self):
+        other = self.product.order(for_user=self.user, billing_address=self.billing_address)
+        self._credit_user(1500)
+
+        obligations = Order.objects.create_next_payment_obligations(
+            [self.order, other], timezone="UTC", now=datetime(2099, 6, 15, tzinfo=UTC)
+        )
+
+        self.assertEqual([o.outstanding_cents for o in obligations], [0, 500])
+        self.assertEqual(self.user.credit_balance_cents, 0)
+        for obligation in obligations:
+            obligation.refresh_from_db()
+        self.assertEqual([o.settled for o in obligations], [True, False])
+
+    def test_settled_follows_payments(self):
+        obligation = self.order.get_or_create_next_payment_obligation(timezone="UTC")
+        self.assertFalse(obligation.settled)
+
+        record_receipt(obligation, 400)
+        obligation.refresh_from_db()
+        self.assertFalse(obligation.settled)
+
+        record_receipt(obligation, 600)
+        obligation.refresh_from_db()
+        self.assertTrue(obligation.settled)
+
+    def test_settled_resets_when_payment_is_deleted(self):
+        obligation = self.order.get_or_create_next_payment_obligation(timezone="UTC")
+        payment = record_receipt(obligation, 1000)
+        obligation.refresh_from_db()
+        self.assertTrue(obligation.settled)
+
+        payment.delete()
+        obligation.refresh_from_db()
+        self.assertFalse(obligation.settled)
+
 
 class TestNextPeriod(TestCase):
     def test_next_period_quarter(self):
@@ -436,3 +613,65 @@ class TestGeneratePaymentObligations(FastTenantTestCase):
         self.assertGreaterEqual(
             (new.year, new.period), (first_obligation.year, first_obligation.period)
         )
+
+    def test_only_looks_at_due_orders(self):
+        order = self._create_order()
+        order.refresh_from_db()
+        self.assertIsNotNone(order.next_due_at)
+
+        create = Order.objects.create_next_payment_obligations
+        with patch.object(Order.objects, "create_next_payment_obligations", wraps=create) as spy:
+            gen_obligations(now=order.next_due_at - timedelta(seconds=1))
+            spy.assert_not_called()
+            self.assertEqual(PaymentObligation.objects.filter(order=order).count(), 1)
+
+            gen_obligations(now=order.next_due_at)
+            self.assertEqual([list(call.args[0]) for call in spy.call_args_list], [[order]])
+        self.assertEqual(PaymentObligation.objects.filter(order=order).count(), 2)
+
+    def test_deleting_an_obligation_makes_the_order_due(self):
+        order = self._create_order()
+        PaymentObligation.objects.filter(order=order).delete()
+
+        order.refresh_from_db()
+        self.assertIsNone(order.next_due_at)
+        gen_obligations()
+        self.assertTrue(PaymentObligation.objects.filter(order=order).exists())
+
+
+@patch.object(tenantcache, "_enabled", True)
+class TestTenantCache(TestCase):
+    def tearDown(self):
+        tenantcache.clear()
+
+    def test_account_is_cached_until_changed(self):
+        # Accounts are only cached once the transaction that read them commits
+        with self.captureOnCommitCallbacks(execute=True):
+            account, created = Account.get_revenue_account()
+            self.assertTrue(created)
+            self.assertIsNone(tenantcache.get(f"account:{account.code}"))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(Account.get_revenue_account(), (account, False))
+
+        account.name = "Income"
+        account.save()
+        self.assertIsNone(tenantcache.get(f"account:{account.code}"))
+        self.assertEqual(Account.get_revenue_account()[0].name, "Income")
+
+    def test_account_read_in_rolled_back_transaction_is_not_cached(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with suppress(IntegrityError), transaction.atomic():
+                # Found again later in the same transaction, as in bulk billing
+                Account.get_waived_account()
+                Account.get_waived_account()
+                raise IntegrityError
+        self.assertIsNone(tenantcache.get(f"account:{ACCOUNT_WAIVED}"))
+        self.assertFalse(Account.objects.filter(code=ACCOUNT_WAIVED).exists())
+
+    def test_changes_drop_pending_stores(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            account, _ = Account.get_revenue_account()
+            account.name = "Income"
+            account.save()
+        self.assertIsNone(tenantcache.get(f"account:{account.code}"))
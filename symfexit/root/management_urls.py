@@ -4,6 +4,7 @@ from django.urls import include, path
 
 from symfexit.root.utils import enable_if
 from symfexit.tenants.adminsite import global_admin
+from symfexit.worker.views import metrics as worker_metrics
 
 try:
     import django_browser_reload  # noqa
@@ -27,6 +28,7 @@ urlpatterns = (
     [
         path("healthz", health_check, name="healthz"),
         path("management/", global_admin.urls),
+        path("metrics/worker", worker_metrics, name="worker_metrics"),
     ]
     + enable_if(
         django_browser_reload_enabled,
@@ -132,6 +132,19 @@ RUN_TASKS_SYNC = setting_from_env(
     "RUN_TASKS_SYNC", development=False, production=False, testing=True
 )
 
+# Bearer token for scraping worker metrics; the endpoint is disabled when unset
+WORKER_METRICS_TOKEN = setting_from_env("WORKER_METRICS_TOKEN", production=None)
+
+# Maximum number of tasks of one tenant that run at the same time, over all workers
+WORKER_TENANT_CONCURRENCY = setting_from_env("WORKER_TENANT_CONCURRENCY", production=None)
+if WORKER_TENANT_CONCURRENCY is not None:
+    WORKER_TENANT_CONCURRENCY = int(WORKER_TENANT_CONCURRENCY)
+
+# Finished tasks are archived by the daily prune_tasks task after this many days
+WORKER_TASK_RETENTION_DAYS = int(
+    setting_from_env("WORKER_TASK_RETENTION_DAYS", production=30, development=30)
+)
+
 ALLOWED_HOSTS = setting(development=["*"], production=os.getenv("ALLOWED_HOSTS", "").split(","))
 
 if SYMFEXIT_ENV == "development":
@@ -7,7 +7,7 @@ from django.utils.translation import gettext as _
 from django.views.generic import TemplateView
 
 from symfexit.theme.models import TailwindKey
-from symfexit.worker.registry import add_task
+from symfexit.worker.registry import DuplicateTask, add_task
 
 
 class TailwindAdmin(admin.ModelAdmin):
@@ -42,7 +42,10 @@ class RebuildTheme(TemplateView):
         return self.render_to_response(context)
 
     def post(self, request, *args, **kwargs):
-        task = add_task("rebuild_theme", tenant=request.tenant)
+        try:
+            task = add_task("rebuild_theme", tenant=request.tenant, dedupe_key="rebuild_theme")
+        except DuplicateTask as e:
+            task = e.task
         # Add message
         messages.add_message(request, messages.INFO, _("Rebuilding theme, refresh to see progress"))
         return redirect("admin:worker_task_change", task.id)
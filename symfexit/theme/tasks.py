@@ -7,6 +7,7 @@ from symfexit.tenants.models import Client
 from symfexit.theme.models import CurrentThemeVersion, TailwindKey
 from symfexit.theme.utils import get_theme_filename, get_time_millis
 from symfexit.worker import logger
+from symfexit.worker.models import Task
 from symfexit.worker.registry import task_registry
 
 NPX_COMMAND = os.getenv("NPX_COMMAND", "npx")
@@ -21,7 +22,7 @@ def write_out_overrides():
         print("}", file=f)
 
 
-@task_registry.register("rebuild_theme")
+@task_registry.register("rebuild_theme", priority=Task.Priority.HIGH)
 def rebuild_theme(*, tenant: Client):
     logger.log(f"Rebuilding theme for tentant {tenant.name}")
     input_css = settings.DYNAMIC_THEME_WORKING_DIR / "src" / "styles.css"
@@ -1,15 +1,43 @@
 from django.contrib import admin
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.urls.resolvers import URLPattern
+from django.utils.translation import gettext_lazy as _
 
 from symfexit.tenants.adminsite import global_admin
-from symfexit.worker.models import Task
+from symfexit.worker import metrics
+from symfexit.worker.models import RateLimitBucket, ScheduleState, Task, TaskArchive
 
 # Register your models here.
 
 
 @admin.register(Task)
 class TaskAdmin(admin.ModelAdmin):
-    fields = ("name", "status", "output", "created_at", "picked_up_at", "completed_at")
+    fields = (
+        "name",
+        "status",
+        "queue",
+        "priority",
+        "dedupe_key",
+        "run_at",
+        "attempts",
+        "parent",
+        "depends_on",
+        "payload",
+        "progress",
+        "result",
+        "output",
+        "created_at",
+        "picked_up_at",
+        "completed_at",
+    )
     readonly_fields = (
+        "attempts",
+        "parent",
+        "depends_on",
+        "payload",
+        "progress",
+        "result",
         "output",
         "created_at",
     )
@@ -21,8 +49,107 @@ class TaskAdmin(admin.ModelAdmin):
 
 @admin.register(Task, site=global_admin)
 class GlobalTaskAdmin(admin.ModelAdmin):
-    fields = ("name", "status", "output", "created_at", "picked_up_at", "completed_at")
+    change_list_template = "admin/worker/task/global_change_list.html"
+
+    fields = (
+        "name",
+        "status",
+        "queue",
+        "priority",
+        "dedupe_key",
+        "run_at",
+        "attempts",
+        "parent",
+        "depends_on",
+        "payload",
+        "progress",
+        "result",
+        "output",
+        "created_at",
+        "picked_up_at",
+        "completed_at",
+    )
     readonly_fields = (
+        "attempts",
+        "parent",
+        "depends_on",
+        "payload",
+        "progress",
+        "result",
+        "output",
+        "created_at",
+    )
+
+    def get_urls(self) -> list[URLPattern]:
+        return [
+            path(
+                "metrics/",
+                self.admin_site.admin_view(self.metrics_view),
+                name="worker_task_metrics",
+            ),
+        ] + super().get_urls()
+
+    def metrics_view(self, request):
+        context = {
+            **self.admin_site.each_context(request),
+            "title": _("Worker metrics"),
+            "opts": self.model._meta,
+            "queue_depth": metrics.queue_depth(),
+            "windows": [
+                (name, metrics.task_statistics(window)) for name, window in metrics.WINDOWS.items()
+            ],
+            "quantile_labels": [f"p{round(q * 100)}" for q in metrics.QUANTILES],
+        }
+        return TemplateResponse(request, "admin/worker/task/metrics.html", context)
+
+
+@admin.register(TaskArchive, site=global_admin)
+class GlobalTaskArchiveAdmin(admin.ModelAdmin):
+    list_display = ("name", "status", "tenant", "created_at", "completed_at")
+    list_filter = ("status", "name")
+    fields = (
+        "task_id",
+        "name",
+        "status",
+        "queue",
+        "tenant",
+        "attempts",
+        "payload",
         "output",
         "created_at",
+        "picked_up_at",
+        "completed_at",
+        "archived_at",
     )
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ScheduleState, site=global_admin)
+class GlobalScheduleStateAdmin(admin.ModelAdmin):
+    """Schedules are declared in code; only the next run time can be changed here."""
+
+    list_display = ("name", "last_run_at", "next_run_at")
+    fields = ("name", "last_run_at", "next_run_at")
+    readonly_fields = ("name", "last_run_at")
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(RateLimitBucket, site=global_admin)
+class GlobalRateLimitBucketAdmin(admin.ModelAdmin):
+    list_display = ("name", "tokens", "updated_at")
+    fields = ("name", "tokens", "updated_at")
+    readonly_fields = fields
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,155 @@
+import asyncio
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
+from django.utils import timezone
+
+from symfexit.worker import scheduler, tenantcache
+from symfexit.worker.models import Task
+from symfexit.worker.registry import task_registry
+
+
+class AsyncWorker:
+    """Run up to `max_tasks` tasks at the same time in one process.
+
+    An asyncio loop listens for NOTIFYs on an async psycopg connection and
+    hands claimed tasks to a pool of threads. Django's ORM and the tenant's
+    schema are bound to the connection of a thread, so every task, coroutine
+    functions included, runs in a pool thread with its own connection; that
+    thread also holds the task's advisory lock. Tasks registered with
+    `max_concurrency` run at most that many at a time in this worker.
+
+    With `idle_timeout`, the worker stops once it has had nothing to run for
+    that many seconds.
+    """
+
+    def __init__(self, command, *, queues, max_tasks, sweep_interval, idle_timeout=None):
+        self.command = command
+        self.queues = queues
+        self.max_tasks = max_tasks
+        self.sweep_interval = sweep_interval
+        self.idle_timeout = idle_timeout
+        self.executor = ThreadPoolExecutor(max_workers=max_tasks, thread_name_prefix="task")
+        # Housekeeping needs a connection that never holds task locks; see
+        # TaskQuerySet.requeue_abandoned.
+        self.housekeeping = ThreadPoolExecutor(max_workers=1, thread_name_prefix="housekeeping")
+        self.running = Counter()
+        self.jobs = set()
+        self.wakeup = None
+        self.loop = None
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.wakeup = asyncio.Event()
+        params = connections[DEFAULT_DB_ALIAS].get_connection_params()
+        # Django's cursor factory and adapters are for sync connections only
+        params.pop("cursor_factory", None)
+        params.pop("context", None)
+        listen_connection = await psycopg.AsyncConnection.connect(autocommit=True, **params)
+        await listen_connection.execute("LISTEN worker_task")
+        await listen_connection.execute(f"LISTEN {tenantcache.CHANNEL}")
+        tenantcache.enable()
+        listener = asyncio.create_task(self.listen(listen_connection))
+        next_schedule_at = None
+        idle_since = self.loop.time()
+        try:
+            while True:
+                next_schedule_at = await self.in_housekeeping(self.housekeep, next_schedule_at)
+                await self.fill()
+                if self.jobs:
+                    idle_since = self.loop.time()
+                elif self.idle_timeout is not None:
+                    if self.loop.time() - idle_since >= self.idle_timeout:
+                        self.command.stdout.write(f"Stopping idle worker (pid {os.getpid()})")
+                        return
+                timeout = await self.in_housekeeping(
+                    self.command.wait_timeout, self.sweep_interval, self.queues, next_schedule_at
+                )
+                if self.idle_timeout is not None and not self.jobs:
+                    timeout = min(
+                        timeout, max(idle_since + self.idle_timeout - self.loop.time(), 0)
+                    )
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except TimeoutError:
+                    pass
+                self.wakeup.clear()
+        finally:
+            listener.cancel()
+            await listen_connection.close()
+
+    async def listen(self, listen_connection):
+        async for notify in listen_connection.notifies():
+            if notify.channel == tenantcache.CHANNEL:
+                tenantcache.clear(notify.payload)
+            else:
+                self.wakeup.set()
+
+    async def in_housekeeping(self, func, *args):
+        return await self.loop.run_in_executor(self.housekeeping, func, *args)
+
+    def housekeep(self, next_schedule_at):
+        """Queue abandoned and scheduled tasks, and return when the next schedule is due."""
+        close_old_connections()
+        if requeued := Task.objects.requeue_abandoned():
+            self.command.stdout.write(f"Queued {requeued} abandoned task(s) again")
+        if next_schedule_at is None or next_schedule_at <= timezone.now():
+            for name in scheduler.run_due_schedules():
+                self.command.stdout.write(f"Queued scheduled task {name}")
+            next_schedule_at = scheduler.next_due_at()
+        return next_schedule_at
+
+    async def fill(self):
+        """Start claimed tasks until all slots are busy or nothing can be claimed."""
+        while len(self.jobs) < self.max_tasks:
+            claimed = self.loop.create_future()
+            job = self.loop.run_in_executor(
+                self.executor, self.claim_and_handle, claimed, self.saturated()
+            )
+            task = await claimed
+            if task is None:
+                await job
+                return
+            self.running[task.name] += 1
+            self.jobs.add(job)
+            job.add_done_callback(lambda job, name=task.name: self.job_done(job, name))
+
+    def saturated(self):
+        """Names of tasks that already run as often as their `max_concurrency` allows."""
+        saturated = []
+        for name, count in self.running.items():
+            registered = task_registry.get(name)
+            if registered is not None and registered.max_concurrency is not None:
+                if count >= registered.max_concurrency:
+                    saturated.append(name)
+        return saturated
+
+    def job_done(self, job, name):
+        self.jobs.discard(job)
+        self.running[name] -= 1
+        if job.exception() is not None:
+            self.command.stderr.write(f"Task {name} crashed the worker thread: {job.exception()}")
+        # A slot came free
+        self.wakeup.set()
+
+    def claim_and_handle(self, claimed, saturated):
+        """Claim one task in this thread and run it, reporting the claim to the loop first."""
+        try:
+            close_old_connections()
+            tasks = (
+                Task.objects.due()
+                .in_queues(self.queues)
+                .exclude(name__in=saturated)
+                .claim(1, tenant_concurrency=settings.WORKER_TENANT_CONCURRENCY)
+            )
+        except BaseException:
+            self.loop.call_soon_threadsafe(claimed.set_result, None)
+            raise
+        task = tasks[0] if tasks else None
+        self.loop.call_soon_threadsafe(claimed.set_result, task)
+        if task is not None:
+            self.command.handle_task(task)
@@ -0,0 +1,40 @@
+"""Running long tasks in chunks that are committed one by one.
+
+A task registered with ``atomic=False`` can use `run_in_chunks` to process a
+queryset in short transactions. Every chunk stores the task's progress in the
+same transaction as its work, so when the task is retried, or queued again
+after its worker died, it continues after the last committed chunk instead of
+starting over.
+"""
+
+from collections import Counter
+
+from django.db import transaction
+
+from symfexit.worker.models import Task
+from symfexit.worker.registry import current_task
+
+
+def run_in_chunks(queryset, size, handle):
+    """Call `handle` with the rows of `queryset`, `size` at a time, each in a transaction.
+
+    Rows are handled in primary key order. `handle` may return a dict of
+    counts; the totals over all chunks, including those committed by earlier
+    attempts of the task, are returned.
+    """
+    task = current_task()
+    progress = (task.progress if task is not None else None) or {}
+    after = progress.get("after")
+    totals = Counter(progress.get("totals", {}))
+    queryset = queryset.order_by("pk")
+    while True:
+        remaining = queryset if after is None else queryset.filter(pk__gt=after)
+        rows = list(remaining[:size])
+        if not rows:
+            return dict(totals)
+        with transaction.atomic():
+            totals.update(handle(rows) or {})
+            after = rows[-1].pk
+            if task is not None:
+                task.progress = {"after": after, "totals": dict(totals)}
+                Task.objects.filter(id=task.id).update(progress=task.progress)
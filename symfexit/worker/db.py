@@ -0,0 +1,18 @@
+import threading
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+_local = threading.local()
+
+
+def side_connection():
+    """A separate autocommit connection for this thread.
+
+    Tasks run in a transaction, so writes that must be visible to others right
+    away, or that must not wait for the task's transaction, go over this
+    connection instead. Django connections can't be shared between threads, so
+    every thread gets its own.
+    """
+    if getattr(_local, "connection", None) is None:
+        _local.connection = connections.create_connection(DEFAULT_DB_ALIAS)
+    return _local.connection
@@ -0,0 +1,77 @@
+"""Tasks that only run after other tasks have completed.
+
+A task added with ``add_task(..., depends_on=[...])`` is blocked until all of
+the tasks it depends on have completed. It's then queued, so a worker picks it
+up right away. When any of them fails, the blocked task fails too, and so do
+the tasks that depend on it in turn.
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from symfexit.worker.models import Task
+from symfexit.worker.registry import task_registry
+
+FAILED_STATUSES = {Task.Status.EXCEPTION, Task.Status.ERROR_UNKNOWN_TASK}
+
+
+def initial_status(depends_on):
+    """The status for a new task that depends on `depends_on`.
+
+    The dependencies are locked until the current transaction ends, so none of
+    them can finish before the new task is stored as their dependent.
+    """
+    if not depends_on:
+        return Task.Status.QUEUED
+    statuses = set(
+        Task.objects.select_for_update()
+        .filter(id__in=[task.id for task in depends_on])
+        .values_list("status", flat=True)
+    )
+    if statuses & FAILED_STATUSES:
+        return Task.Status.EXCEPTION
+    if statuses <= {Task.Status.COMPLETED}:
+        return Task.Status.QUEUED
+    return Task.Status.BLOCKED
+
+
+def task_finished(task):
+    """Queue or fail the blocked tasks that depend on `task`, now that it's done."""
+    if task.status in Task.ACTIVE_STATUSES:
+        return
+    for dependent_id in task.dependents.filter(status=Task.Status.BLOCKED).values_list(
+        "id", flat=True
+    ):
+        _unblock(dependent_id)
+
+
+def _unblock(task_id):
+    # Locking the dependent serializes the tasks it depends on finishing at the
+    # same time, so exactly one of them sees that all others are done.
+    with transaction.atomic():
+        task = Task.objects.select_for_update().filter(id=task_id).first()
+        if task is None or task.status != Task.Status.BLOCKED:
+            return
+        failed = task.depends_on.filter(status__in=FAILED_STATUSES).first()
+        if failed is not None:
+            fail(task, failed)
+        elif not task.depends_on.exclude(status=Task.Status.COMPLETED).exists():
+            task.status = Task.Status.QUEUED
+        else:
+            return
+        task.save()
+
+    if task.status == Task.Status.QUEUED:
+        if settings.RUN_TASKS_SYNC:
+            task_registry.execute(task)
+    else:
+        task_finished(task)
+
+
+def fail(task, cause=None):
+    """Mark `task` as failed without running it, because a task it depends on failed."""
+    task.status = Task.Status.EXCEPTION
+    task.completed_at = timezone.now()
+    reason = f"task {cause.id} ({cause.name})" if cause is not None else "a task it depends on"
+    task.output = "\n\n".join(filter(None, [task.output, f"Not run, because {reason} failed"]))
@@ -0,0 +1,44 @@
+import zlib
+
+from django.db import connection
+
+# Namespaces for the two-key form of the Postgres advisory lock functions, so
+# locks taken for different purposes never collide.
+TASK_LOCK = 1
+SCHEDULE_LOCK = 2
+TENANT_CLAIM_LOCK = 3
+EXCLUSIVE_TASK_LOCK = 4
+
+
+def key_for(name) -> int:
+    """A stable 32-bit lock key for `name`, for locks on things without an integer id."""
+    key = zlib.crc32(name.encode())
+    return key - 2**32 if key >= 2**31 else key
+
+
+def try_acquire(namespace, key) -> bool:
+    """Take a session-level advisory lock without waiting.
+
+    Session-level locks outlive transactions and are released when the
+    connection closes, so a held lock shows that its process is still alive.
+    Postgres advisory locks are re-entrant within one session.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_lock(%s::int, %s::int)", [namespace, key])
+        return cursor.fetchone()[0]
+
+
+def release(namespace, key):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_unlock(%s::int, %s::int)", [namespace, key])
+
+
+def try_acquire_xact(namespace, key) -> bool:
+    """Take a transaction-level advisory lock without waiting.
+
+    The lock is released when the current transaction ends, so this must be
+    called inside `transaction.atomic()`.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_xact_lock(%s::int, %s::int)", [namespace, key])
+        return cursor.fetchone()[0]
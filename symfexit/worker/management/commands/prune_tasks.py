@@ -0,0 +1,32 @@
+from django.core.management import BaseCommand
+
+from symfexit.worker.retention import prune_tasks
+
+
+class Command(BaseCommand):
+    help = "Archive or delete finished tasks older than a number of days"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=30,
+            help="Prune tasks that finished more than this many days ago.",
+        )
+        parser.add_argument(
+            "--no-archive",
+            action="store_true",
+            help="Delete the tasks instead of moving them to the task archive.",
+        )
+        parser.add_argument("--batch_size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        pruned = prune_tasks(
+            days=options["days"],
+            archive=not options["no_archive"],
+            batch_size=options["batch_size"],
+        )
+        action = "Deleted" if options["no_archive"] else "Archived"
+        self.stdout.write(
+            self.style.SUCCESS(f"{action} {pruned} task(s) older than {options['days']} days")
+        )
@@ -1,58 +1,229 @@
-from django.core.management import BaseCommand
+import asyncio
+import os
+import time
+from functools import partial
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
 from django.core.management.base import CommandParser
-from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db import DEFAULT_DB_ALIAS, connections
 from django.utils import timezone
 from django_tenants.utils import tenant_context
 
+from symfexit.worker import dependencies, locks, scheduler, subtasks, tenantcache
+from symfexit.worker.asyncworker import AsyncWorker
 from symfexit.worker.models import Task
+from symfexit.worker.pool import WorkerPool
 from symfexit.worker.registry import task_registry
 
 
 class Command(BaseCommand):
     help = "Run the worker"
+    listen_connection = None
 
     def add_arguments(self, parser: CommandParser) -> None:
-        parser.add_argument("--batch_size", type=int, default=10)
+        parser.add_argument(
+            "--batch_size",
+            type=int,
+            default=10,
+            help="Tasks to handle before checking for abandoned and scheduled tasks again.",
+        )
+        parser.add_argument(
+            "--sweep_interval",
+            type=float,
+            default=30.0,
+            help="Seconds between sweeps for queued tasks when no NOTIFY arrives.",
+        )
+        parser.add_argument(
+            "--queue",
+            action="append",
+            dest="queues",
+            help="Only handle tasks from this queue. Can be given multiple times. "
+            "Defaults to handling all queues.",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=1,
+            help="Number of worker processes to run. Every process claims tasks independently.",
+        )
+        parser.add_argument(
+            "--max_concurrency",
+            type=int,
+            help="Start more worker processes, up to this number, while due tasks queue up. "
+            "They stop again after --idle_timeout seconds without work.",
+        )
+        parser.add_argument(
+            "--idle_timeout",
+            type=float,
+            default=60.0,
+            help="Seconds without work after which a process started by --max_concurrency stops.",
+        )
+        parser.add_argument(
+            "--async",
+            action="store_true",
+            dest="use_async",
+            help="Run several tasks at the same time in every worker process, "
+            "for tasks that mostly wait on the network.",
+        )
+        parser.add_argument(
+            "--max_tasks",
+            type=int,
+            default=10,
+            help="Number of tasks every worker process runs at the same time with --async.",
+        )
 
     def handle(self, *args, **options):
-        self.stdout.write("Starting worker")
-        listen_connection = connections.create_connection(DEFAULT_DB_ALIAS).cursor().connection
-        listen_connection.execute("LISTEN worker_task")
-        notifies = listen_connection.notifies()
-        # Process any pending notifications
-        with transaction.atomic():
+        concurrency = options["concurrency"]
+        if concurrency < 1:
+            raise CommandError("--concurrency must be at least 1")
+        if options["max_tasks"] < 1:
+            raise CommandError("--max_tasks must be at least 1")
+        max_concurrency = options["max_concurrency"] or concurrency
+        if max_concurrency < concurrency:
+            raise CommandError("--max_concurrency must be at least --concurrency")
+        if max_concurrency == 1:
+            self.run_worker(options)
+            return
+        if max_concurrency > concurrency:
+            self.stdout.write(
+                f"Starting worker pool with {concurrency} to {max_concurrency} processes"
+            )
+        else:
+            self.stdout.write(f"Starting worker pool with {concurrency} processes")
+        WorkerPool(
+            partial(self.run_worker, options),
+            concurrency,
+            self.stdout,
+            max_size=max_concurrency,
+            queues=options["queues"],
+            idle_timeout=options["idle_timeout"],
+        ).run()
+
+    def run_worker(self, options, idle_timeout=None):
+        """Handle tasks until stopped, or until idle for `idle_timeout` seconds if given."""
+        queues = ", ".join(options["queues"]) if options["queues"] else "all queues"
+        if options["use_async"]:
+            self.stdout.write(
+                f"Starting async worker (pid {os.getpid()}) for {queues}, "
+                f"running up to {options['max_tasks']} tasks"
+            )
+            worker = AsyncWorker(
+                self,
+                queues=options["queues"],
+                max_tasks=options["max_tasks"],
+                sweep_interval=options["sweep_interval"],
+                idle_timeout=idle_timeout,
+            )
+            asyncio.run(worker.run())
+            return
+        self.stdout.write(f"Starting worker (pid {os.getpid()}) for {queues}")
+        tenantcache.enable()
+        self.listen_connection = connections.create_connection(DEFAULT_DB_ALIAS).cursor().connection
+        self.listen_connection.execute("LISTEN worker_task")
+        self.listen_connection.execute(f"LISTEN {tenantcache.CHANNEL}")
+        next_schedule_at = None
+        idle_since = time.monotonic()
+        while True:
+            if requeued := Task.objects.requeue_abandoned():
+                self.stdout.write(f"Queued {requeued} abandoned task(s) again")
+            if next_schedule_at is None or next_schedule_at <= timezone.now():
+                for name in scheduler.run_due_schedules():
+                    self.stdout.write(f"Queued scheduled task {name}")
+                next_schedule_at = scheduler.next_due_at()
+            handled = self.drain(options["batch_size"], options["queues"])
+            if handled:
+                idle_since = time.monotonic()
+            elif idle_timeout is not None and time.monotonic() - idle_since >= idle_timeout:
+                self.stdout.write(f"Stopping idle worker (pid {os.getpid()})")
+                return
+            if handled == options["batch_size"]:
+                # There may be more tasks to handle right away
+                continue
+            # A NOTIFY is only a hint that there is work: wait for one, or for the
+            # sweep interval to pass so tasks with a missed NOTIFY are picked up too.
+            # Delayed tasks and schedules shorten the wait, so they run on time
+            # without polling.
+            timeout = self.wait_timeout(
+                options["sweep_interval"], options["queues"], next_schedule_at
+            )
+            if idle_timeout is not None:
+                timeout = min(timeout, max(idle_since + idle_timeout - time.monotonic(), 0))
+            self.receive_notifies(timeout=timeout, stop_after=1)
+            # Coalesce a burst of NOTIFYs into a single drain
+            self.receive_notifies(timeout=0)
+
+    def receive_notifies(self, timeout, stop_after=None):
+        """Wait up to `timeout` seconds for NOTIFYs, applying cache invalidations among them."""
+        for notify in self.listen_connection.notifies(timeout=timeout, stop_after=stop_after):
+            if notify.channel == tenantcache.CHANNEL:
+                tenantcache.clear(notify.payload)
+
+    def drain(self, batch_size, queues=None):
+        """Handle up to `batch_size` queued tasks, or until there are none left to claim.
+
+        Tasks are claimed one at a time, right before they run, so a task only
+        counts as running, against its tenant's concurrency too, once it has
+        started, and the tasks after it stay available to idle workers.
+
+        Returns the number of tasks handled.
+        """
+        handled = 0
+        while handled < batch_size:
             tasks = (
-                Task.objects.select_for_update(skip_locked=True)
-                .filter(status=Task.Status.QUEUED)
-                .order_by("created_at")
-            )[: options["batch_size"]]
-            for task in tasks:
-                self.handle_task(task)
-        # LISTEN for any NOTIFYs and handle them
-        for notify in notifies:
-            task_id = int(notify.payload)
-            with transaction.atomic():
-                task = (
-                    Task.objects.select_for_update(skip_locked=True)
-                    .filter(status=Task.Status.QUEUED, id=task_id)
-                    .first()
-                )
-                if task is None:
-                    continue
-                self.handle_task(task)
+                Task.objects.due()
+                .in_queues(queues)
+                .claim(1, tenant_concurrency=settings.WORKER_TENANT_CONCURRENCY)
+            )
+            if not tasks:
+                break
+            if self.listen_connection is not None:
+                # Don't run a task with settings that changed while draining
+                self.receive_notifies(timeout=0)
+            self.handle_task(tasks[0])
+            handled += 1
+        return handled
+
+    def wait_timeout(self, sweep_interval, queues=None, next_schedule_at=None):
+        next_run_at = (
+            Task.objects.delayed()
+            .in_queues(queues)
+            .order_by("run_at")
+            .values_list("run_at", flat=True)
+            .first()
+        )
+        wake_at = min(filter(None, [next_run_at, next_schedule_at]), default=None)
+        if wake_at is None:
+            return sweep_interval
+        return min(sweep_interval, max((wake_at - timezone.now()).total_seconds(), 0))
 
     def handle_task(self, task):
-        task.picked_up_at = timezone.now()
-        if task.name not in task_registry:
-            task.status = Task.Status.ERROR_UNKNOWN_TASK
-            task.save()
-            self.stdout.write(f"Unknown task {task.name}, marking as error")
-            return
+        try:
+            if task.name not in task_registry:
+                task.status = Task.Status.ERROR_UNKNOWN_TASK
+                task.save()
+                subtasks.task_finished(task)
+                dependencies.task_finished(task)
+                self.stdout.write(f"Unknown task {task.name}, marking as error")
+                return
 
-        with tenant_context(task.tenant):
-            task_registry.execute(task)
+            with tenant_context(task.tenant):
+                task_registry.execute(task, live_output=True)
+        finally:
+            locks.release(locks.TASK_LOCK, task.id)
+
+        if task.status == Task.Status.QUEUED:
+            self.stdout.write(f"Task {task.name} failed, retrying at {task.run_at}")
+            return
+        if task.status == Task.Status.WAITING:
+            self.stdout.write(f"Task {task.name} is waiting for its sub-tasks")
+            return
 
+        timings = (
+            f"waited {task.queue_latency.total_seconds():.3f}s, "
+            f"ran {task.run_duration.total_seconds():.3f}s"
+        )
         if task.status == Task.Status.COMPLETED:
-            self.stdout.write(f"Task {task.name} completed")
+            self.stdout.write(f"Task {task.name} completed ({timings})")
         elif task.status == Task.Status.EXCEPTION:
-            self.stdout.write(f"Task {task.name} failed with exception")
+            self.stdout.write(f"Task {task.name} failed with exception ({timings})")
@@ -0,0 +1,153 @@
+from datetime import timedelta
+
+from django.db.models import (
+    Aggregate,
+    Count,
+    DurationField,
+    ExpressionWrapper,
+    F,
+    Min,
+    Q,
+)
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from symfexit.worker.models import Task
+
+WINDOWS = {
+    "5m": timedelta(minutes=5),
+    "1h": timedelta(hours=1),
+    "24h": timedelta(days=1),
+}
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Percentile(Aggregate):
+    function = "PERCENTILE_CONT"
+    template = "%(function)s(%(quantile)s) WITHIN GROUP (ORDER BY %(expressions)s)"
+    output_field = DurationField()
+
+    def __init__(self, expression, quantile, **extra):
+        super().__init__(expression, quantile=float(quantile), **extra)
+
+
+def queue_depth():
+    """Number and oldest creation time of unfinished tasks, per tenant, task name and status."""
+    now = timezone.now()
+    rows = (
+        Task.objects.active()
+        .values("tenant__schema_name", "name", "status")
+        .annotate(count=Count("id"), oldest=Min("created_at"))
+        .order_by("tenant__schema_name", "name", "status")
+    )
+    return [
+        {
+            "tenant": row["tenant__schema_name"] or "",
+            "name": row["name"],
+            "status": row["status"],
+            "count": row["count"],
+            "oldest_age": now - row["oldest"],
+        }
+        for row in rows
+    ]
+
+
+def task_statistics(window):
+    """Outcome counts and latency/duration quantiles of tasks finished within `window`."""
+    # Postgres' GREATEST ignores NULLs, so tasks without run_at count from created_at
+    latency = ExpressionWrapper(
+        F("picked_up_at") - Greatest("created_at", "run_at"), output_field=DurationField()
+    )
+    duration = ExpressionWrapper(
+        F("completed_at") - F("picked_up_at"), output_field=DurationField()
+    )
+    aggregates = {
+        "completed": Count("id", filter=Q(status=Task.Status.COMPLETED)),
+        "failed": Count("id", filter=Q(status=Task.Status.EXCEPTION)),
+    }
+    for quantile in QUANTILES:
+        aggregates[f"latency_{quantile}"] = Percentile(latency, quantile)
+        aggregates[f"duration_{quantile}"] = Percentile(duration, quantile)
+
+    rows = (
+        Task.objects.finished()
+        .filter(completed_at__gte=timezone.now() - window, picked_up_at__isnull=False)
+        .values("name")
+        .annotate(**aggregates)
+        .order_by("name")
+    )
+    statistics = []
+    for row in rows:
+        finished = row["completed"] + row["failed"]
+        statistics.append(
+            {
+                "name": row["name"],
+                "completed": row["completed"],
+                "failed": row["failed"],
+                "failure_rate": row["failed"] / finished if finished else 0.0,
+                "latency": {q: row[f"latency_{q}"] for q in QUANTILES},
+                "duration": {q: row[f"duration_{q}"] for q in QUANTILES},
+            }
+        )
+    return statistics
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+
+def _seconds(value):
+    return 0.0 if value is None else value.total_seconds()
+
+
+def render_prometheus():
+    """All worker metrics in the Prometheus text exposition format."""
+    lines = [
+        "# HELP symfexit_worker_tasks Number of unfinished tasks.",
+        "# TYPE symfexit_worker_tasks gauge",
+    ]
+    depth = queue_depth()
+    for row in depth:
+        labels = _labels(tenant=row["tenant"], task=row["name"], status=row["status"])
+        lines.append(f"symfexit_worker_tasks{labels} {row['count']}")
+    lines += [
+        "# HELP symfexit_worker_oldest_task_age_seconds Age of the oldest unfinished task.",
+        "# TYPE symfexit_worker_oldest_task_age_seconds gauge",
+    ]
+    for row in depth:
+        labels = _labels(tenant=row["tenant"], task=row["name"], status=row["status"])
+        lines.append(
+            f"symfexit_worker_oldest_task_age_seconds{labels} {_seconds(row['oldest_age'])}"
+        )
+
+    finished = ["# TYPE symfexit_worker_tasks_finished gauge"]
+    failure_rate = ["# TYPE symfexit_worker_task_failure_ratio gauge"]
+    latency = ["# TYPE symfexit_worker_task_pickup_latency_seconds gauge"]
+    duration = ["# TYPE symfexit_worker_task_duration_seconds gauge"]
+    for window_name, window in WINDOWS.items():
+        for row in task_statistics(window):
+            labels = {"task": row["name"], "window": window_name}
+            for outcome in ("completed", "failed"):
+                finished.append(
+                    f"symfexit_worker_tasks_finished{_labels(**labels, outcome=outcome)} "
+                    f"{row[outcome]}"
+                )
+            failure_rate.append(
+                f"symfexit_worker_task_failure_ratio{_labels(**labels)} {row['failure_rate']}"
+            )
+            for quantile in QUANTILES:
+                quantile_labels = _labels(**labels, quantile=quantile)
+                latency.append(
+                    f"symfexit_worker_task_pickup_latency_seconds{quantile_labels} "
+                    f"{_seconds(row['latency'][quantile])}"
+                )
+                duration.append(
+                    f"symfexit_worker_task_duration_seconds{quantile_labels} "
+                    f"{_seconds(row['duration'][quantile])}"
+                )
+    lines += finished + failure_rate + latency + duration
+    return "\n".join(lines) + "\n"
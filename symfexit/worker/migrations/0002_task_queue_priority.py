@@ -0,0 +1,36 @@
+# Generated by Django 6.0.4 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("worker", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="task",
+            name="priority",
+            field=models.SmallIntegerField(
+                choices=[(-10, "Low"), (0, "Normal"), (10, "High")],
+                default=0,
+                help_text="Tasks with a higher priority are picked up first.",
+                verbose_name="priority",
+            ),
+        ),
+        migrations.AddField(
+            model_name="task",
+            name="queue",
+            field=models.CharField(default="default", max_length=50, verbose_name="queue"),
+        ),
+        migrations.AddIndex(
+            model_name="task",
+            index=models.Index(
+                condition=models.Q(("status", "queued")),
+                fields=["queue", "-priority", "created_at"],
+                name="worker_task_claim_idx",
+            ),
+        ),
+    ]
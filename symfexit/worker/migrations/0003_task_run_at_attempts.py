@@ -0,0 +1,28 @@
+# Generated by Django 6.0.4 on 2026-10-18 10:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("worker", "0002_task_queue_priority"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="task",
+            name="attempts",
+            field=models.PositiveSmallIntegerField(default=0, verbose_name="attempts"),
+        ),
+        migrations.AddField(
+            model_name="task",
+            name="run_at",
+            field=models.DateTimeField(
+                blank=True,
+                help_text="The task is not picked up before this time.",
+                null=True,
+                verbose_name="run at",
+            ),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 6.0.4 on 2026-10-18 11:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("worker", "0003_task_run_at_attempts"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="task",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("queued", "Queued"),
+                    ("running", "Running"),
+                    ("completed", "Completed"),
+                    ("not_registered", "Unknown task (not registered)"),
+                    ("exception", "Exception"),
+                ],
+                default="queued",
+                max_length=20,
+                verbose_name="status",
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0.4 on 2026-10-18 11:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("worker", "0004_alter_task_status"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="task",
+            name="payload",
+            field=models.JSONField(blank=True, null=True, verbose_name="payload"),
+        ),
+    ]
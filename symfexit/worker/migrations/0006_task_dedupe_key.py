@@ -0,0 +1,37 @@
+# Generated by Django 6.0.4 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tenants", "0001_initial"),
+        ("worker", "0005_task_payload"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="task",
+            name="dedupe_key",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="Only one queued or running task per tenant can have this key.",
+                max_length=200,
+                verbose_name="deduplication key",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="task",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(
+                    ("status__in", ["queued", "running"]),
+                    models.Q(("dedupe_key", ""), _negated=True),
+                ),
+                fields=("tenant", "dedupe_key"),
+                name="worker_task_dedupe_key_unique_when_active",
+                nulls_distinct=False,
+            ),
+        ),
+    ]
@@ -0,0 +1,93 @@
+# Generated by Django 6.0.4 on 2026-10-18 12:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tenants", "0001_initial"),
+        ("worker", "0006_task_dedupe_key"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TaskArchive",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("task_id", models.IntegerField(verbose_name="task identifier")),
+                ("name", models.CharField(max_length=20, verbose_name="name")),
+                ("queue", models.CharField(max_length=50, verbose_name="queue")),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("queued", "Queued"),
+                            ("running", "Running"),
+                            ("completed", "Completed"),
+                            ("not_registered", "Unknown task (not registered)"),
+                            ("exception", "Exception"),
+                        ],
+                        max_length=20,
+                        verbose_name="status",
+                    ),
+                ),
+                ("payload", models.JSONField(blank=True, null=True, verbose_name="payload")),
+                ("compressed_output", models.BinaryField(verbose_name="compressed output")),
+                (
+                    "attempts",
+                    models.PositiveSmallIntegerField(default=0, verbose_name="attempts"),
+                ),
+                ("created_at", models.DateTimeField(verbose_name="created at")),
+                (
+                    "picked_up_at",
+                    models.DateTimeField(blank=True, null=True, verbose_name="picked up at"),
+                ),
+                (
+                    "completed_at",
+                    models.DateTimeField(blank=True, null=True, verbose_name="completed at"),
+                ),
+                (
+                    "archived_at",
+                    models.DateTimeField(auto_now_add=True, verbose_name="archived at"),
+                ),
+                (
+                    "tenant",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="tenants.client",
+                        verbose_name="tenant",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "archived task",
+                "verbose_name_plural": "archived tasks",
+                "ordering": ["-created_at"],
+            },
+        ),
+        migrations.AddIndex(
+            model_name="task",
+            index=models.Index(
+                condition=models.Q(("run_at__isnull", False), ("status", "queued")),
+                fields=["run_at"],
+                name="worker_task_delayed_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="task",
+            index=models.Index(
+                condition=models.Q(("status", "running")),
+                fields=["id"],
+                name="worker_task_running_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 6.0.4 on 2026-10-18 13:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("worker", "0007_taskarchive_task_indexes"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="task",
+            index=models.Index(fields=["completed_at"], name="worker_task_completed_idx"),
+        ),
+    ]
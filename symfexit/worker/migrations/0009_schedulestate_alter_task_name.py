@@ -0,0 +1,45 @@
+# Generated by Django 6.0.4 on 2026-10-18 13:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("worker", "0008_task_completed_idx"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ScheduleState",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True, primary_key=True, serialize=False, verbose_name="ID"
+                    ),
+                ),
+                ("name", models.CharField(max_length=50, unique=True, verbose_name="name")),
+                (
+                    "last_run_at",
+                    models.DateTimeField(blank=True, null=True, verbose_name="last run at"),
+                ),
+                ("next_run_at", models.DateTimeField(verbose_name="next run at")),
+            ],
+            options={
+                "verbose_name": "schedule",
+                "verbose_name_plural": "schedules",
+                "ordering": ["next_run_at"],
+            },
+        ),
+        migrations.AlterField(
+            model_name="task",
+            name="name",
+            field=models.CharField(max_length=50, verbose_name="name"),
+        ),
+        migrations.AlterField(
+            model_name="taskarchive",
+            name="name",
+            field=models.CharField(max_length=50, verbose_name="name"),
+        ),
+    ]
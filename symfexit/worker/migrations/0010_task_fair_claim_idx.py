@@ -0,0 +1,22 @@
+# Generated by Django 6.0.4 on 2026-10-18 14:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tenants", "0001_initial"),
+        ("worker", "0009_schedulestate_alter_task_name"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="task",
+            index=models.Index(
+                condition=models.Q(("status", "queued")),
+                fields=["tenant", "priority", "created_at", "id"],
+                name="worker_task_fair_claim_idx",
+            ),
+        ),
+    ]
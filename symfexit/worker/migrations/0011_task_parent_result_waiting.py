@@ -0,0 +1,97 @@
+# Generated by Django 6.0.4 on 2026-10-18 15:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tenants", "0001_initial"),
+        ("worker", "0010_task_fair_claim_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="task",
+            name="parent",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="subtasks",
+                to="worker.task",
+                verbose_name="parent task",
+            ),
+        ),
+        migrations.AddField(
+            model_name="task",
+            name="result",
+            field=models.JSONField(
+                blank=True,
+                help_text="The value returned by the task function.",
+                null=True,
+                verbose_name="result",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="task",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("queued", "Queued"),
+                    ("running", "Running"),
+                    ("waiting", "Waiting for sub-tasks"),
+                    ("completed", "Completed"),
+                    ("not_registered", "Unknown task (not registered)"),
+                    ("exception", "Exception"),
+                ],
+                default="queued",
+                max_length=20,
+                verbose_name="status",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="taskarchive",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("queued", "Queued"),
+                    ("running", "Running"),
+                    ("waiting", "Waiting for sub-tasks"),
+                    ("completed", "Completed"),
+                    ("not_registered", "Unknown task (not registered)"),
+                    ("exception", "Exception"),
+                ],
+                max_length=20,
+                verbose_name="status",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="task",
+            name="dedupe_key",
+            field=models.CharField(
+                blank=True,
+                default="",
+                help_text="Only one unfinished task per tenant can have this key.",
+                max_length=200,
+                verbose_name="deduplication key",
+            ),
+        ),
+        migrations.RemoveConstraint(
+            model_name="task",
+            name="worker_task_dedupe_key_unique_when_active",
+        ),
+        migrations.AddConstraint(
+            model_name="task",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(
+                    ("status__in", ["queued", "running", "waiting"]),
+                    models.Q(("dedupe_key", ""), _negated=True),
+                ),
+                fields=("tenant", "dedupe_key"),
+                name="worker_task_dedupe_key_unique_when_active",
+                nulls_distinct=False,
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0.4 on 2026-10-18 15:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("worker", "0011_task_parent_result_waiting"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="task",
+            name="progress",
+            field=models.JSONField(
+                blank=True,
+                help_text="Where a task that commits in chunks continues when it runs again.",
+                null=True,
+                verbose_name="progress",
+            ),
+        ),
+    ]
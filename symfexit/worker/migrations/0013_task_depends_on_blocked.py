@@ -0,0 +1,76 @@
+# Generated by Django 6.0.4 on 2026-10-18 16:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tenants", "0001_initial"),
+        ("worker", "0012_task_progress"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="task",
+            name="depends_on",
+            field=models.ManyToManyField(
+                blank=True,
+                help_text="The task is not picked up before these tasks have completed.",
+                related_name="dependents",
+                to="worker.task",
+                verbose_name="depends on",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="task",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("queued", "Queued"),
+                    ("running", "Running"),
+                    ("waiting", "Waiting for sub-tasks"),
+                    ("blocked", "Waiting for other tasks"),
+                    ("completed", "Completed"),
+                    ("not_registered", "Unknown task (not registered)"),
+                    ("exception", "Exception"),
+                ],
+                default="queued",
+                max_length=20,
+                verbose_name="status",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="taskarchive",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("queued", "Queued"),
+                    ("running", "Running"),
+                    ("waiting", "Waiting for sub-tasks"),
+                    ("blocked", "Waiting for other tasks"),
+                    ("completed", "Completed"),
+                    ("not_registered", "Unknown task (not registered)"),
+                    ("exception", "Exception"),
+                ],
+                max_length=20,
+                verbose_name="status",
+            ),
+        ),
+        migrations.RemoveConstraint(
+            model_name="task",
+            name="worker_task_dedupe_key_unique_when_active",
+        ),
+        migrations.AddConstraint(
+            model_name="task",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(
+                    ("status__in", ["queued", "running", "waiting", "blocked"]),
+                    models.Q(("dedupe_key", ""), _negated=True),
+                ),
+                fields=("tenant", "dedupe_key"),
+                name="worker_task_dedupe_key_unique_when_active",
+                nulls_distinct=False,
+            ),
+        ),
+    ]
@@ -1,18 +1,272 @@
-from django.db import connection, models
+import zlib
+from datetime import timedelta
+from functools import reduce
+from operator import or_
+
+from django.db import connection, models, transaction
+from django.db.models import Count, Exists, F, OuterRef, Q, Window
+from django.db.models.functions import RowNumber
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
+from symfexit.worker import locks
+from symfexit.worker.registry import DEFAULT_QUEUE, task_registry
+
+# How many more candidates than requested `TaskQuerySet.claim` considers
+CLAIM_OVERFETCH = 4
+
+
+class TaskQuerySet(models.QuerySet):
+    def queued(self):
+        return self.filter(status=Task.Status.QUEUED)
+
+    def due(self):
+        """Queued tasks that may run now."""
+        return self.queued().filter(Q(run_at__isnull=True) | Q(run_at__lte=timezone.now()))
+
+    def delayed(self):
+        """Queued tasks that are scheduled to run later."""
+        return self.queued().filter(run_at__gt=timezone.now())
+
+    def active(self):
+        return self.filter(status__in=Task.ACTIVE_STATUSES)
+
+    def finished(self):
+        return self.exclude(status__in=Task.ACTIVE_STATUSES)
+
+    def in_queues(self, queues):
+        if not queues:
+            return self
+        return self.filter(queue__in=queues)
+
+    def claim(self, limit, tenant_concurrency=None):
+        """Mark up to `limit` of these tasks as running and return them.
+
+        Tenants take turns: within each priority, the first task of every tenant
+        comes before the second task of any tenant, so one tenant's bulk run
+        can't starve the others. With `tenant_concurrency`, no more than that
+        many tasks of one tenant run at the same time, over all workers; tenants
+        at that cap are left out before ranking, so their queued tasks never
+        crowd out those of other tenants. A task registered as `exclusive` is
+        not claimed while another task with its name runs for the same tenant.
+
+        Rows are locked with SKIP LOCKED, so concurrent workers never claim the
+        same task. Every claimed task also gets an advisory lock that the caller
+        holds until the task is done; see `requeue_abandoned`.
+        """
+        candidates = self._without_busy_exclusive()
+        if tenant_concurrency is not None:
+            candidates = candidates.exclude(tenant_id__in=self._tenants_at_cap(tenant_concurrency))
+        tasks = []
+        tried_ids = set()
+        passed_over = []
+        # Candidates can still be passed over, because another worker claims
+        # them, for their tenant or their exclusive task at the same time. Then
+        # try the next ones.
+        while len(tasks) < limit:
+            remaining = candidates.exclude(id__in=tried_ids)
+            if passed_over:
+                remaining = remaining.exclude(reduce(or_, passed_over))
+            claimed, tried, passed = remaining._claim_round(limit - len(tasks), tenant_concurrency)
+            if not tried:
+                break
+            tasks += claimed
+            tried_ids |= tried
+            passed_over += passed
+        return tasks
+
+    def _claim_round(self, limit, tenant_concurrency):
+        """Claim up to `limit` of the first candidates in one transaction.
+
+        Returns the claimed tasks, the ids of all candidates considered, and
+        conditions matching the candidates that were passed over for tenant
+        concurrency or exclusivity, which later rounds leave out.
+        """
+        # Postgres can't combine FOR UPDATE with window functions, so the
+        # candidates are ranked first and locked afterwards. Extra candidates
+        # make up for the ones other workers are claiming at the same time.
+        ranked = (
+            self.annotate(
+                tenant_rank=Window(
+                    RowNumber(),
+                    partition_by=[F("tenant_id"), F("priority")],
+                    order_by=[F("created_at").asc(), F("id").asc()],
+                )
+            )
+            .filter(tenant_rank__lte=limit)
+            .order_by("-priority", "tenant_rank", "created_at")
+        )
+        candidate_ids = list(ranked.values_list("id", flat=True)[: limit * CLAIM_OVERFETCH])
+        if not candidate_ids:
+            return [], set(), []
+        order = {task_id: position for position, task_id in enumerate(candidate_ids)}
+        passed_over = []
+        with transaction.atomic():
+            candidates = sorted(
+                Task.objects.filter(id__in=candidate_ids, status=Task.Status.QUEUED)
+                .select_for_update(skip_locked=True)
+                .order_by(),
+                key=lambda task: order[task.id],
+            )
+            if tenant_concurrency is not None:
+                fitting = self._within_tenant_concurrency(candidates, tenant_concurrency)
+                passed_over += [
+                    Q(tenant_id=task.tenant_id) for task in candidates if task not in fitting
+                ]
+                candidates = fitting
+            fitting = self._without_running_exclusive(candidates)
+            passed_over += [
+                Q(tenant_id=task.tenant_id, name=task.name)
+                for task in candidates
+                if task not in fitting
+            ]
+            candidates = fitting
+            tasks = []
+            for task in candidates:
+                if len(tasks) == limit:
+                    break
+                if locks.try_acquire(locks.TASK_LOCK, task.id):
+                    tasks.append(task)
+            now = timezone.now()
+            for task in tasks:
+                task.status = Task.Status.RUNNING
+                task.picked_up_at = now
+            Task.objects.bulk_update(tasks, ["status", "picked_up_at"])
+        return tasks, set(candidate_ids), passed_over
+
+    def _without_busy_exclusive(self):
+        """These tasks, minus exclusive tasks that already run or wait for their tenant."""
+        exclusive_names = task_registry.exclusive_names()
+        if not exclusive_names:
+            return self
+        busy = Task.objects.filter(
+            tenant_id=OuterRef("tenant_id"),
+            name=OuterRef("name"),
+            status__in=[Task.Status.RUNNING, Task.Status.WAITING],
+        )
+        return self.exclude(Q(name__in=exclusive_names) & Exists(busy))
+
+    def _tenants_at_cap(self, tenant_concurrency):
+        """A subquery of the tenants that run `tenant_concurrency` tasks already."""
+        return (
+            Task.objects.filter(status=Task.Status.RUNNING, tenant_id__isnull=False)
+            .values("tenant_id")
+            .annotate(count=Count("id"))
+            .filter(count__gte=tenant_concurrency)
+            .values("tenant_id")
+        )
+
+    def _within_tenant_concurrency(self, candidates, tenant_concurrency):
+        """The candidates that fit in their tenant's number of free slots.
+
+        A transaction-level lock per tenant keeps concurrent claims from seeing
+        the same free slots; tenants another worker is claiming for are skipped.
+        """
+        tenant_ids = {task.tenant_id for task in candidates if task.tenant_id is not None}
+        tenant_ids = {
+            tenant_id
+            for tenant_id in tenant_ids
+            if locks.try_acquire_xact(locks.TENANT_CLAIM_LOCK, tenant_id)
+        }
+        free = dict.fromkeys(tenant_ids, tenant_concurrency)
+        running = (
+            Task.objects.filter(status=Task.Status.RUNNING, tenant_id__in=tenant_ids)
+            .values("tenant_id")
+            .annotate(count=Count("id"))
+            .order_by()
+        )
+        for row in running:
+            free[row["tenant_id"]] -= row["count"]
+        fitting = []
+        for task in candidates:
+            if task.tenant_id is None:
+                fitting.append(task)
+            elif free.get(task.tenant_id, 0) > 0:
+                free[task.tenant_id] -= 1
+                fitting.append(task)
+        return fitting
+
+    def _without_running_exclusive(self, candidates):
+        """The candidates, minus exclusive tasks that already run for their tenant.
+
+        A task waiting for its sub-tasks still counts as running. A transaction-
+        level lock per tenant and task name keeps concurrent claims from both
+        seeing no running task; names another worker is claiming are skipped.
+        """
+        exclusive = set()
+        for task in candidates:
+            registered = task_registry.get(task.name)
+            if registered is not None and registered.exclusive:
+                exclusive.add((task.tenant_id, task.name))
+        if not exclusive:
+            return candidates
+        free = {
+            (tenant_id, name)
+            for tenant_id, name in exclusive
+            if locks.try_acquire_xact(
+                locks.EXCLUSIVE_TASK_LOCK, locks.key_for(f"{tenant_id}:{name}")
+            )
+        }
+        if free:
+            running = Task.objects.filter(
+                reduce(or_, (Q(tenant_id=tenant_id, name=name) for tenant_id, name in free)),
+                status__in=[Task.Status.RUNNING, Task.Status.WAITING],
+            ).values_list("tenant_id", "name")
+            free -= set(running)
+        fitting = []
+        for task in candidates:
+            key = (task.tenant_id, task.name)
+            if key not in exclusive:
+                fitting.append(task)
+            elif key in free:
+                # Only one of several queued tasks with the same name
+                free.remove(key)
+                fitting.append(task)
+        return fitting
+
+    def requeue_abandoned(self):
+        """Queue running tasks again when the worker running them has gone away.
+
+        A worker holds the advisory lock of a task for as long as it runs it, so
+        a lock that can be taken belongs to a worker that died. Must not be called
+        while this session is running tasks itself, as advisory locks are re-entrant.
+        """
+        requeued = 0
+        for task_id in self.filter(status=Task.Status.RUNNING).values_list("id", flat=True):
+            if not locks.try_acquire(locks.TASK_LOCK, task_id):
+                continue
+            try:
+                requeued += Task.objects.filter(id=task_id, status=Task.Status.RUNNING).update(
+                    status=Task.Status.QUEUED
+                )
+            finally:
+                locks.release(locks.TASK_LOCK, task_id)
+        return requeued
+
 
 class Task(models.Model):
     class Status(models.TextChoices):
         QUEUED = "queued", _("Queued")
+        RUNNING = "running", _("Running")
+        WAITING = "waiting", _("Waiting for sub-tasks")
+        BLOCKED = "blocked", _("Waiting for other tasks")
         COMPLETED = "completed", _("Completed")
         ERROR_UNKNOWN_TASK = "not_registered", _("Unknown task (not registered)")
         EXCEPTION = "exception", _("Exception")
 
+    class Priority(models.IntegerChoices):
+        LOW = -10, _("Low")
+        NORMAL = 0, _("Normal")
+        HIGH = 10, _("High")
+
+    # Tasks that aren't done yet
+    ACTIVE_STATUSES = (Status.QUEUED, Status.RUNNING, Status.WAITING, Status.BLOCKED)
+
     id = models.AutoField(_("identifier"), primary_key=True)
-    name = models.CharField(_("name"), max_length=20)
+    name = models.CharField(_("name"), max_length=50)
     args = models.BinaryField(_("arguments"), blank=True, null=True)
     kwargs = models.BinaryField(_("keyword arguments"), blank=True, null=True)
+    payload = models.JSONField(_("payload"), blank=True, null=True)
     output = models.TextField(_("output"), blank=True)
     status = models.CharField(
         _("status"),
@@ -27,14 +281,102 @@ class Task(models.Model):
         related_name="tasks",
         verbose_name=_("tenant"),
     )
+    queue = models.CharField(_("queue"), max_length=50, default=DEFAULT_QUEUE)
+    priority = models.SmallIntegerField(
+        _("priority"),
+        choices=Priority,
+        default=Priority.NORMAL,
+        help_text=_("Tasks with a higher priority are picked up first."),
+    )
+    dedupe_key = models.CharField(
+        _("deduplication key"),
+        max_length=200,
+        blank=True,
+        default="",
+        help_text=_("Only one unfinished task per tenant can have this key."),
+    )
+    run_at = models.DateTimeField(
+        _("run at"),
+        null=True,
+        blank=True,
+        help_text=_("The task is not picked up before this time."),
+    )
+    attempts = models.PositiveSmallIntegerField(_("attempts"), default=0)
+    parent = models.ForeignKey(
+        "self",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="subtasks",
+        verbose_name=_("parent task"),
+    )
+    depends_on = models.ManyToManyField(
+        "self",
+        symmetrical=False,
+        blank=True,
+        related_name="dependents",
+        verbose_name=_("depends on"),
+        help_text=_("The task is not picked up before these tasks have completed."),
+    )
+    progress = models.JSONField(
+        _("progress"),
+        blank=True,
+        null=True,
+        help_text=_("Where a task that commits in chunks continues when it runs again."),
+    )
+    result = models.JSONField(
+        _("result"),
+        blank=True,
+        null=True,
+        help_text=_("The value returned by the task function."),
+    )
     created_at = models.DateTimeField(_("created at"), auto_now_add=True)
     picked_up_at = models.DateTimeField(_("picked up at"), null=True, blank=True)
     completed_at = models.DateTimeField(_("completed at"), null=True, blank=True)
 
+    objects = TaskQuerySet.as_manager()
+
     class Meta:
         verbose_name = _("task")
         verbose_name_plural = _("tasks")
         ordering = ["-created_at"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["tenant", "dedupe_key"],
+                condition=Q(status__in=["queued", "running", "waiting", "blocked"])
+                & ~Q(dedupe_key=""),
+                nulls_distinct=False,
+                name="worker_task_dedupe_key_unique_when_active",
+            ),
+        ]
+        indexes = [
+            # Supports the worker's claim query: queued tasks of the subscribed
+            # queues, highest priority first, then oldest first.
+            models.Index(
+                fields=["queue", "-priority", "created_at"],
+                condition=Q(status="queued"),
+                name="worker_task_claim_idx",
+            ),
+            # Lets the claim query rank queued tasks per tenant without sorting
+            models.Index(
+                fields=["tenant", "priority", "created_at", "id"],
+                condition=Q(status="queued"),
+                name="worker_task_fair_claim_idx",
+            ),
+            # Finds the next delayed task, so the worker knows how long to sleep
+            models.Index(
+                fields=["run_at"],
+                condition=Q(status="queued", run_at__isnull=False),
+                name="worker_task_delayed_idx",
+            ),
+            models.Index(
+                fields=["id"],
+                condition=Q(status="running"),
+                name="worker_task_running_idx",
+            ),
+            # Finds the tasks that finished within a metrics window
+            models.Index(fields=["completed_at"], name="worker_task_completed_idx"),
+        ]
 
     def __str__(self) -> str:
         return (
@@ -46,3 +388,104 @@ class Task(models.Model):
         if self.status == self.Status.QUEUED:
             with connection.cursor() as cursor:
                 cursor.execute("NOTIFY worker_task, %s;", [str(self.id)])
+
+    @property
+    def queue_latency(self) -> timedelta | None:
+        """Time the task spent in the queue after it became due, before a worker picked it up."""
+        if self.picked_up_at is None:
+            return None
+        due_at = self.created_at
+        if self.run_at is not None:
+            due_at = max(due_at, self.run_at)
+        return self.picked_up_at - due_at
+
+    @property
+    def run_duration(self) -> timedelta | None:
+        if self.picked_up_at is None or self.completed_at is None:
+            return None
+        return self.completed_at - self.picked_up_at
+
+
+class TaskArchive(models.Model):
+    """A finished task moved out of the task table by the `prune_tasks` command.
+
+    The output is stored zlib-compressed.
+    """
+
+    task_id = models.IntegerField(_("task identifier"))
+    name = models.CharField(_("name"), max_length=50)
+    queue = models.CharField(_("queue"), max_length=50)
+    status = models.CharField(_("status"), max_length=20, choices=Task.Status)
+    tenant = models.ForeignKey(
+        "tenants.Client",
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name="+",
+        verbose_name=_("tenant"),
+    )
+    payload = models.JSONField(_("payload"), blank=True, null=True)
+    compressed_output = models.BinaryField(_("compressed output"))
+    attempts = models.PositiveSmallIntegerField(_("attempts"), default=0)
+    created_at = models.DateTimeField(_("created at"))
+    picked_up_at = models.DateTimeField(_("picked up at"), null=True, blank=True)
+    completed_at = models.DateTimeField(_("completed at"), null=True, blank=True)
+    archived_at = models.DateTimeField(_("archived at"), auto_now_add=True)
+
+    class Meta:
+        verbose_name = _("archived task")
+        verbose_name_plural = _("archived tasks")
+        ordering = ["-created_at"]
+
+    def __str__(self) -> str:
+        return f"{self.name}: {self.created_at}"
+
+    @classmethod
+    def from_task(cls, task):
+        return cls(
+            task_id=task.id,
+            name=task.name,
+            queue=task.queue,
+            status=task.status,
+            tenant_id=task.tenant_id,
+            payload=task.payload,
+            compressed_output=zlib.compress(task.output.encode()),
+            attempts=task.attempts,
+            created_at=task.created_at,
+            picked_up_at=task.picked_up_at,
+            completed_at=task.completed_at,
+        )
+
+    @property
+    def output(self) -> str:
+        return zlib.decompress(self.compressed_output).decode()
+
+
+class ScheduleState(models.Model):
+    """When a scheduled task was last queued, and when it is due next."""
+
+    name = models.CharField(_("name"), max_length=50, unique=True)
+    last_run_at = models.DateTimeField(_("last run at"), null=True, blank=True)
+    next_run_at = models.DateTimeField(_("next run at"))
+
+    class Meta:
+        verbose_name = _("schedule")
+        verbose_name_plural = _("schedules")
+        ordering = ["next_run_at"]
+
+    def __str__(self) -> str:
+        return self.name
+
+
+class RateLimitBucket(models.Model):
+    """The state of a token bucket of `symfexit.worker.ratelimit`."""
+
+    name = models.CharField(_("name"), max_length=100, unique=True)
+    tokens = models.FloatField(_("tokens"))
+    updated_at = models.DateTimeField(_("updated at"))
+
+    class Meta:
+        verbose_name = _("rate limit")
+        verbose_name_plural = _("rate limits")
+
+    def __str__(self) -> str:
+        return self.name
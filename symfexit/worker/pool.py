@@ -0,0 +1,152 @@
+import math
+import os
+import signal
+import sys
+import time
+import traceback
+from datetime import timedelta
+
+from django.db import DatabaseError, connections
+from django.db.models import Count, Min
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from symfexit.worker.models import Task
+
+
+class WorkerPool:
+    """Supervise a number of forked worker processes.
+
+    Every child calls ``target`` and gets its own database connection: all
+    connections are closed before forking, so Django reconnects lazily in the
+    child. Children that exit while the pool is running are restarted.
+
+    With a ``max_size`` above ``size`` the pool grows while due tasks wait in
+    ``queues``: about one extra process per ``TASKS_PER_WORKER`` due tasks once
+    the oldest has waited ``SCALE_UP_AFTER``. Those extra processes call
+    ``target`` with ``idle_timeout`` and stop by themselves when they found
+    nothing to do for that many seconds, so they never stop in the middle of
+    a task and are not restarted.
+    """
+
+    RESTART_DELAY = 1.0
+    SCALE_INTERVAL = 5.0
+    SCALE_UP_AFTER = timedelta(seconds=10)
+    TASKS_PER_WORKER = 10
+
+    def __init__(self, target, size, stdout, *, max_size=None, queues=None, idle_timeout=60.0):
+        self.target = target
+        self.size = size
+        self.max_size = max(size, max_size or size)
+        self.queues = queues
+        self.idle_timeout = idle_timeout
+        self.stdout = stdout
+        # pid -> slot number, used to keep the log output stable across restarts.
+        # Slots from `size` up are the extra processes of a scaled up pool.
+        self.children = {}
+        self.stopping = False
+
+    def run(self):
+        previous_handlers = {
+            sig: signal.signal(sig, self._stop) for sig in (signal.SIGINT, signal.SIGTERM)
+        }
+        try:
+            for slot in range(self.size):
+                self._spawn(slot)
+            self._supervise()
+        finally:
+            for sig, handler in previous_handlers.items():
+                signal.signal(sig, handler)
+
+    def _supervise(self):
+        autoscale = self.max_size > self.size
+        next_scale_at = time.monotonic()
+        while self.children:
+            if autoscale and not self.stopping and time.monotonic() >= next_scale_at:
+                self._scale()
+                next_scale_at = time.monotonic() + self.SCALE_INTERVAL
+            try:
+                # Without autoscaling there is nothing to do between exits
+                pid, status = os.waitpid(-1, os.WNOHANG if autoscale else 0)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                time.sleep(1.0)
+                continue
+            slot = self.children.pop(pid, None)
+            if slot is None:
+                continue
+            exit_code = os.waitstatus_to_exitcode(status)
+            if self.stopping:
+                self.stdout.write(f"Worker {slot} (pid {pid}) stopped")
+                continue
+            if slot >= self.size:
+                self.stdout.write(f"Worker {slot} (pid {pid}) exited with status {exit_code}")
+                continue
+            self.stdout.write(
+                f"Worker {slot} (pid {pid}) exited with status {exit_code}, restarting"
+            )
+            time.sleep(self.RESTART_DELAY)
+            if not self.stopping:
+                self._spawn(slot)
+
+    def wanted_size(self):
+        """The number of processes the current backlog of due tasks calls for."""
+        backlog = (
+            Task.objects.due()
+            .in_queues(self.queues)
+            .aggregate(count=Count("id"), oldest=Min(Greatest("created_at", "run_at")))
+        )
+        if not backlog["count"] or timezone.now() - backlog["oldest"] < self.SCALE_UP_AFTER:
+            return self.size
+        wanted = self.size + math.ceil(backlog["count"] / self.TASKS_PER_WORKER)
+        return min(wanted, self.max_size)
+
+    def _scale(self):
+        try:
+            wanted = self.wanted_size()
+        except DatabaseError as e:
+            self.stdout.write(f"Could not check the queue for scaling: {e}")
+            return
+        busy = set(self.children.values())
+        free = [slot for slot in range(self.size, self.max_size) if slot not in busy]
+        for slot in free[: max(wanted - len(self.children), 0)]:
+            pid = self._spawn(slot)
+            self.stdout.write(f"Tasks are queueing up, started worker {slot} (pid {pid})")
+
+    def _spawn(self, slot):
+        # Never share a database socket between parent and child
+        connections.close_all()
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid != 0:
+            self.children[pid] = slot
+            return pid
+
+        # Child process
+        exit_code = 0
+        try:
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            if slot >= self.size:
+                self.target(idle_timeout=self.idle_timeout)
+            else:
+                self.target()
+        except KeyboardInterrupt:
+            pass
+        except BaseException:
+            traceback.print_exc()
+            exit_code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(exit_code)
+
+    def _stop(self, signum, frame):
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
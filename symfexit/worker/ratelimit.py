@@ -0,0 +1,73 @@
+"""Token buckets shared by all workers, stored in Postgres.
+
+A bucket holds up to `burst` tokens and gains `rate` tokens per second. Taking
+a token always succeeds, but may leave the bucket below zero: the caller then
+sleeps until the bucket would have refilled to zero. Callers thereby reserve
+their turn in order, and together never exceed the rate, on however many
+workers and hosts. Time is taken from the database, so clock differences
+between hosts don't matter.
+"""
+
+import time
+from dataclasses import dataclass
+
+from symfexit.worker.db import side_connection
+from symfexit.worker.models import RateLimitBucket
+
+
+@dataclass(frozen=True, slots=True)
+class RateLimit:
+    name: str
+    # Tokens per second
+    rate: float
+    burst: int = 1
+
+
+class RateLimited(Exception):
+    """Raised by `acquire` when waiting for a token would take longer than allowed."""
+
+    def __init__(self, limit, wait):
+        super().__init__(f"Rate limit {limit.name} exceeded, next token in {wait:.1f}s")
+        self.limit = limit
+        self.wait = wait
+
+
+def acquire(limit, tokens=1, *, max_wait=None):
+    """Take `tokens` from the bucket of `limit`, sleeping until they're available.
+
+    When that would take longer than `max_wait` seconds, the tokens are given
+    back and `RateLimited` is raised instead.
+    """
+    wait = _take(limit, tokens)
+    if max_wait is not None and wait > max_wait:
+        _take(limit, -tokens)
+        raise RateLimited(limit, wait)
+    if wait > 0:
+        time.sleep(wait)
+    return wait
+
+
+def _take(limit, tokens):
+    """Refill the bucket, take `tokens` from it, and return how long to wait for them."""
+    table = RateLimitBucket._meta.db_table
+    # The side connection is in autocommit mode, so the bucket's row is only
+    # locked for this statement, not for the rest of the task's transaction.
+    with side_connection().cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {table} AS bucket (name, tokens, updated_at)
+            VALUES (%(name)s, %(burst)s - %(tokens)s, clock_timestamp())
+            ON CONFLICT (name) DO UPDATE SET
+                tokens = LEAST(
+                    %(burst)s,
+                    bucket.tokens + %(rate)s * GREATEST(
+                        EXTRACT(EPOCH FROM clock_timestamp() - bucket.updated_at), 0
+                    )
+                ) - %(tokens)s,
+                updated_at = clock_timestamp()
+            RETURNING tokens
+            """,
+            {"name": limit.name, "burst": limit.burst, "rate": limit.rate, "tokens": tokens},
+        )
+        remaining = cursor.fetchone()[0]
+    return max(-remaining / limit.rate, 0.0)
@@ -1,21 +1,29 @@
+import inspect
 import io
 import pickle
 import traceback
+from collections.abc import Callable
+from contextlib import nullcontext
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import UTC, datetime, timedelta
+from typing import TYPE_CHECKING
 
+from asgiref.sync import async_to_sync
 from django.apps import apps
 from django.conf import settings
-from django.db import connection, models, transaction
+from django.db import IntegrityError, connection, transaction
 from django.utils import timezone
 
+from symfexit.worker import serialization
 
-class DBPickler(pickle.Pickler):
-    def persistent_id(self, obj):
-        if isinstance(obj, models.Model) and obj.pk is not None:
-            return f"{obj._meta.app_label}.{obj._meta.model_name}", obj.pk
-        return None
+if TYPE_CHECKING:
+    from symfexit.worker.ratelimit import RateLimit
 
 
 class DBUnpickler(pickle.Unpickler):
+    """Loads the pickled arguments of tasks queued before `Task.payload` existed."""
+
     def persistent_load(self, pid):
         fq_model, pk = pid
         app_label, model_name = fq_model.split(".")
@@ -23,41 +31,186 @@ class DBUnpickler(pickle.Unpickler):
         return model.objects.get(pk=pk)
 
 
+DEFAULT_QUEUE = "default"
+
+_current_task = ContextVar("current_task", default=None)
+
+
+def current_task():
+    """The task that is running in this context, or None outside of a task."""
+    return _current_task.get()
+
+
+class DuplicateTask(Exception):
+    """Raised by add_task when a task with the same dedupe key is still unfinished."""
+
+    def __init__(self, task):
+        super().__init__(f"Task {task.name} with key {task.dedupe_key} is already {task.status}")
+        self.task = task
+
+
+@dataclass(frozen=True, slots=True)
+class RetryPolicy:
+    """How often, and how long after a failure, a task is run again.
+
+    The delay doubles after every failed attempt, starting at `delay` and capped
+    at `max_delay`. Only exceptions that are instances of `retry_on` are retried.
+    """
+
+    max_retries: int = 0
+    delay: timedelta = timedelta(seconds=30)
+    max_delay: timedelta = timedelta(hours=1)
+    retry_on: tuple[type[Exception], ...] = (Exception,)
+
+    def should_retry(self, exception, attempts) -> bool:
+        return attempts <= self.max_retries and isinstance(exception, self.retry_on)
+
+    def delay_for(self, attempts) -> timedelta:
+        return min(self.delay * 2 ** (attempts - 1), self.max_delay)
+
+
+@dataclass(frozen=True, slots=True)
+class Schedule:
+    """Run a task for every tenant each `every`, shifted by `offset`.
+
+    Run times are aligned to the Unix epoch in UTC, so every node computes the
+    same times: `Schedule(every=timedelta(days=1), offset=timedelta(hours=2))`
+    runs daily at 02:00 UTC.
+    """
+
+    every: timedelta
+    offset: timedelta = timedelta(0)
+
+    def next_run_after(self, moment) -> datetime:
+        epoch = datetime(1970, 1, 1, tzinfo=UTC) + self.offset
+        periods = (moment - epoch) // self.every + 1
+        return epoch + periods * self.every
+
+
+@dataclass(frozen=True, slots=True)
+class RegisteredTask:
+    func: Callable
+    # Defaults for tasks queued with add_task, which can override them per task
+    queue: str = DEFAULT_QUEUE
+    priority: int = 0
+    retry: RetryPolicy = field(default_factory=RetryPolicy)
+    # Load model arguments on first access instead of before the task starts
+    lazy_models: bool = False
+    # Queued without arguments for every tenant by the worker's scheduler
+    schedule: Schedule | None = None
+    # Run the task in one transaction. Tasks that commit as they go, for example
+    # with `chunks.run_in_chunks`, register with atomic=False.
+    atomic: bool = True
+    # How many of these tasks one async worker runs at the same time
+    max_concurrency: int | None = None
+    # Every run of the task takes a token from this rate limit first
+    rate_limit: RateLimit | None = None
+    # At most one of these tasks runs per tenant at a time, over all workers
+    exclusive: bool = False
+
+
 class TaskRegistry:
     def __init__(self):
         self._registry = {}
 
-    def register(self, name):
+    def register(  # noqa: PLR0913
+        self,
+        name,
+        *,
+        queue=DEFAULT_QUEUE,
+        priority=0,
+        retry=None,
+        lazy_models=False,
+        schedule=None,
+        atomic=True,
+        max_concurrency=None,
+        rate_limit=None,
+        exclusive=False,
+    ):
         def _register(func):
-            self._registry[name] = func
+            self._registry[name] = RegisteredTask(
+                func,
+                queue=queue,
+                priority=priority,
+                retry=retry or RetryPolicy(),
+                lazy_models=lazy_models,
+                schedule=schedule,
+                atomic=atomic,
+                max_concurrency=max_concurrency,
+                rate_limit=rate_limit,
+                exclusive=exclusive,
+            )
             return func
 
         return _register
 
-    def execute(self, task):
-        from symfexit.worker import logger  # noqa: PLC0415
+    def get(self, name) -> RegisteredTask | None:
+        return self._registry.get(name)
+
+    def schedules(self) -> dict[str, Schedule]:
+        return {
+            name: registered.schedule
+            for name, registered in self._registry.items()
+            if registered.schedule is not None
+        }
+
+    def exclusive_names(self) -> list[str]:
+        return [name for name, registered in self._registry.items() if registered.exclusive]
+
+    def execute(self, task, *, live_output=False):
+        """Run `task` and store its outcome.
+
+        With `live_output` the task's output is written to the database while it
+        runs, which needs a separate connection and is only useful in the worker.
+        """
+        from symfexit.worker import dependencies, logger, ratelimit, subtasks  # noqa: PLC0415
         from symfexit.worker.models import Task  # noqa: PLC0415
 
-        args = DBUnpickler(io.BytesIO(task.args)).load()
-        kwargs = DBUnpickler(io.BytesIO(task.kwargs)).load()
-        logger.clear()
-        try:
-            with transaction.atomic():
-                self._registry[task.name](*args, **kwargs)
-        except Exception as e:
-            task.status = Task.Status.EXCEPTION
-            logoutput = logger.get_output()
-            task.output = (
-                f"{logoutput}\n\nTask failed with exception ({type(e)}): {traceback.format_exc()}"
-            )
-            return
-        else:
-            logoutput = logger.get_output()
-            task.output = logoutput
-            task.status = Task.Status.COMPLETED
-        finally:
-            task.completed_at = timezone.now()
-            task.save()
+        registered = self._registry[task.name]
+        if registered.rate_limit is not None:
+            ratelimit.acquire(registered.rate_limit)
+        task.attempts += 1
+        token = _current_task.set(task)
+        # Output of earlier, failed attempts is kept
+        with logger.capture(task.id if live_output else None, initial=task.output) as task_log:
+            try:
+                with transaction.atomic() if registered.atomic else nullcontext():
+                    args, kwargs = self.load_arguments(task, lazy=registered.lazy_models)
+                    func = registered.func
+                    if inspect.iscoroutinefunction(func):
+                        func = async_to_sync(func)
+                    task.result = func(*args, **kwargs)
+            except Exception as e:
+                task.output = (
+                    f"{task_log.get_output()}\n\n"
+                    f"Task failed with exception ({type(e)}): {traceback.format_exc()}"
+                )
+                if registered.retry.should_retry(e, task.attempts):
+                    task.status = Task.Status.QUEUED
+                    task.run_at = timezone.now() + registered.retry.delay_for(task.attempts)
+                    task.output += f"\nRetrying at {task.run_at} (attempt {task.attempts + 1})"
+                else:
+                    task.status = Task.Status.EXCEPTION
+                    task.completed_at = timezone.now()
+                return
+            else:
+                task.output = task_log.get_output()
+                # Tasks that added sub-tasks complete once those are done
+                if task.status != Task.Status.WAITING:
+                    task.status = Task.Status.COMPLETED
+                    task.completed_at = timezone.now()
+            finally:
+                _current_task.reset(token)
+                task.save()
+                subtasks.task_finished(task)
+                dependencies.task_finished(task)
+
+    def load_arguments(self, task, *, lazy=False):
+        if task.payload is not None:
+            return serialization.loads(task.payload, lazy=lazy)
+        return DBUnpickler(io.BytesIO(task.args)).load(), DBUnpickler(
+            io.BytesIO(task.kwargs)
+        ).load()
 
     def __contains__(self, key):
         return key in self._registry
@@ -66,23 +219,64 @@ class TaskRegistry:
 task_registry = TaskRegistry()
 
 
-def add_task(name, *args, **kwargs):
+def add_task(  # noqa: PLR0913
+    name,
+    *args,
+    queue=None,
+    priority=None,
+    run_at=None,
+    dedupe_key=None,
+    depends_on=None,
+    **kwargs,
+):
+    """Queue the task registered as `name`, called with `args` and `kwargs`.
+
+    `queue` and `priority` override the defaults given to `task_registry.register`.
+    Workers only pick up tasks from the queues they subscribe to, and within
+    those pick tasks with a higher priority first. A task with a `run_at` in the
+    future is not picked up before that time.
+
+    When a task of the current tenant with the same `dedupe_key` is still
+    unfinished, no task is added and `DuplicateTask` is raised instead.
+
+    A task with `depends_on` is only queued once all of those tasks have
+    completed, and fails without running when any of them fails.
+    """
+    from symfexit.worker import dependencies  # noqa: PLC0415
     from symfexit.worker.models import Task  # noqa: PLC0415
 
-    if name not in task_registry:
+    registered = task_registry.get(name)
+    if registered is None:
         raise ValueError(f"Unknown task {name}")
 
-    args_bytes = io.BytesIO()
-    DBPickler(args_bytes).dump(args)
-    kwargs_bytes = io.BytesIO()
-    DBPickler(kwargs_bytes).dump(kwargs)
-
-    task = Task.objects.create(
-        name=name,
-        args=args_bytes.getvalue(),
-        kwargs=kwargs_bytes.getvalue(),
-        tenant=connection.tenant,
-    )
-    if settings.RUN_TASKS_SYNC:
-        task_registry.execute(task)
+    try:
+        with transaction.atomic():
+            status = dependencies.initial_status(depends_on)
+            task = Task(
+                name=name,
+                payload=serialization.dumps(args, kwargs),
+                tenant=connection.tenant,
+                queue=queue if queue is not None else registered.queue,
+                priority=priority if priority is not None else registered.priority,
+                run_at=run_at,
+                dedupe_key=dedupe_key or "",
+                status=status,
+            )
+            if status == Task.Status.EXCEPTION:
+                dependencies.fail(task)
+            task.save()
+            if depends_on:
+                task.depends_on.set(depends_on)
+    except IntegrityError:
+        if not dedupe_key:
+            raise
+        existing = (
+            Task.objects.active().filter(tenant=connection.tenant, dedupe_key=dedupe_key).first()
+        )
+        if existing is None:
+            raise
+        raise DuplicateTask(existing) from None
+    if task.status == Task.Status.QUEUED and settings.RUN_TASKS_SYNC:
+        if run_at is None or run_at <= timezone.now():
+            task_registry.execute(task)
     return task
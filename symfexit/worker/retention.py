@@ -0,0 +1,34 @@
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from symfexit.worker import logger
+from symfexit.worker.models import Task, TaskArchive
+
+
+def prune_tasks(*, days, archive=True, batch_size=1000, tenant=None):
+    """Delete finished tasks that completed more than `days` days ago.
+
+    With `archive` the tasks are first copied to `TaskArchive`. Every batch of
+    `batch_size` tasks is committed on its own, to keep transactions short.
+    With `tenant`, only the tasks of that tenant are pruned. Returns the number
+    of pruned tasks.
+    """
+    cutoff = timezone.now() - timedelta(days=days)
+    old_tasks = Task.objects.finished().filter(
+        Q(completed_at__lt=cutoff) | Q(completed_at__isnull=True, created_at__lt=cutoff)
+    )
+    if tenant is not None:
+        old_tasks = old_tasks.filter(tenant=tenant)
+    pruned = 0
+    while ids := list(old_tasks.order_by("id").values_list("id", flat=True)[:batch_size]):
+        with transaction.atomic():
+            batch = Task.objects.filter(id__in=ids)
+            if archive:
+                TaskArchive.objects.bulk_create(TaskArchive.from_task(task) for task in batch)
+            batch.delete()
+        pruned += len(ids)
+        logger.log(f"Pruned {pruned} tasks")
+    return pruned
@@ -0,0 +1,59 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Min
+from django.utils import timezone
+from django_tenants.utils import get_public_schema_name, get_tenant_model, tenant_context
+
+from symfexit.worker import locks
+from symfexit.worker.models import ScheduleState
+from symfexit.worker.registry import DuplicateTask, add_task, task_registry
+
+
+def active_tenants():
+    """The tenants that scheduled tasks, and the billing commands, run for."""
+    TenantModel = get_tenant_model()
+    if settings.SINGLE_SITE:
+        return TenantModel.objects.all()
+    return TenantModel.objects.exclude(schema_name=get_public_schema_name())
+
+
+def run_due_schedules(now=None):
+    """Queue every scheduled task that is due for all tenants, and return their names.
+
+    Any number of workers can call this: a transaction-level advisory lock per
+    schedule makes sure only one of them fires it, and the stored next run time
+    keeps it from firing twice. Runs missed while no worker was running are
+    made up for with a single run.
+    """
+    now = now or timezone.now()
+    fired = []
+    for name, schedule in task_registry.schedules().items():
+        with transaction.atomic():
+            if not locks.try_acquire_xact(locks.SCHEDULE_LOCK, locks.key_for(name)):
+                continue
+            state, created = ScheduleState.objects.get_or_create(
+                name=name, defaults={"next_run_at": schedule.next_run_after(now)}
+            )
+            if created or state.next_run_at > now:
+                continue
+            for tenant in active_tenants():
+                with tenant_context(tenant):
+                    try:
+                        add_task(name, dedupe_key=name)
+                    except DuplicateTask:
+                        pass
+            state.last_run_at = now
+            state.next_run_at = schedule.next_run_after(now)
+            state.save()
+        fired.append(name)
+    return fired
+
+
+def next_due_at():
+    """When the next schedule is due, or None when no tasks are scheduled."""
+    names = task_registry.schedules().keys()
+    if not names:
+        return None
+    return ScheduleState.objects.filter(name__in=names).aggregate(Min("next_run_at"))[
+        "next_run_at__min"
+    ]
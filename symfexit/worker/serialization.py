@@ -0,0 +1,141 @@
+"""JSON serialization of task arguments.
+
+A payload looks like::
+
+    {
+        "args": [{"__type__": "model", "model": "tenants.client", "pk": 1}],
+        "kwargs": {"now": {"__type__": "date", "value": "2026-01-01"}},
+        "models": {"tenants.client": [1]},
+    }
+
+Values JSON can't represent are tagged with ``__type__``. Model instances are
+stored as references, and ``models`` lists every referenced primary key per
+model, so loading a payload costs one query per model instead of one per object.
+"""
+
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from uuid import UUID
+
+from django.apps import apps
+from django.db import models
+from django.utils.functional import SimpleLazyObject
+
+TYPE_KEY = "__type__"
+
+
+def dumps(args, kwargs) -> dict:
+    refs = {}
+    payload = {
+        "args": [_encode(value, refs) for value in args],
+        "kwargs": {key: _encode(value, refs) for key, value in kwargs.items()},
+    }
+    if refs:
+        payload["models"] = {label: list(pks.values()) for label, pks in refs.items()}
+    return payload
+
+
+def loads(payload, *, lazy=False):
+    """Return the `(args, kwargs)` stored in `payload`.
+
+    Model references are loaded with one ``pk__in`` query per model. With `lazy`
+    they are loaded on first access instead, still in one query per model.
+    """
+    loader = _ModelLoader(payload.get("models", {}))
+    if not lazy:
+        loader.load_all()
+    args = [_decode(value, loader, lazy) for value in payload["args"]]
+    kwargs = {key: _decode(value, loader, lazy) for key, value in payload["kwargs"].items()}
+    return args, kwargs
+
+
+def _encode(value, refs):  # noqa: PLR0911
+    match value:
+        case None | bool() | int() | float() | str():
+            return value
+        case models.Model():
+            if value.pk is None:
+                raise TypeError(f"Can't pass unsaved {value._meta.label} to a task")
+            label = value._meta.label_lower
+            pk = _encode(value.pk, refs)
+            refs.setdefault(label, {})[str(value.pk)] = pk
+            return {TYPE_KEY: "model", "model": label, "pk": pk}
+        case list():
+            return [_encode(item, refs) for item in value]
+        case tuple():
+            return {TYPE_KEY: "tuple", "value": [_encode(item, refs) for item in value]}
+        case dict() if TYPE_KEY not in value and all(isinstance(k, str) for k in value):
+            return {key: _encode(item, refs) for key, item in value.items()}
+        case dict():
+            items = [[_encode(k, refs), _encode(v, refs)] for k, v in value.items()]
+            return {TYPE_KEY: "dict", "value": items}
+        case datetime():
+            return {TYPE_KEY: "datetime", "value": value.isoformat()}
+        case date():
+            return {TYPE_KEY: "date", "value": value.isoformat()}
+        case time():
+            return {TYPE_KEY: "time", "value": value.isoformat()}
+        case timedelta():
+            return {TYPE_KEY: "timedelta", "value": value.total_seconds()}
+        case Decimal():
+            return {TYPE_KEY: "decimal", "value": str(value)}
+        case UUID():
+            return {TYPE_KEY: "uuid", "value": str(value)}
+    raise TypeError(f"Can't pass {type(value).__name__} to a task")
+
+
+_DECODERS = {
+    "datetime": datetime.fromisoformat,
+    "date": date.fromisoformat,
+    "time": time.fromisoformat,
+    "timedelta": lambda seconds: timedelta(seconds=seconds),
+    "decimal": Decimal,
+    "uuid": UUID,
+}
+
+
+def _decode(value, loader, lazy):
+    if isinstance(value, list):
+        return [_decode(item, loader, lazy) for item in value]
+    if not isinstance(value, dict):
+        return value
+    match value.get(TYPE_KEY):
+        case None:
+            return {key: _decode(item, loader, lazy) for key, item in value.items()}
+        case "model":
+            pk = _decode(value["pk"], loader, lazy)
+            if lazy:
+                return SimpleLazyObject(lambda: loader.get(value["model"], pk))
+            return loader.get(value["model"], pk)
+        case "tuple":
+            return tuple(_decode(item, loader, lazy) for item in value["value"])
+        case "dict":
+            return {_decode(k, loader, lazy): _decode(v, loader, lazy) for k, v in value["value"]}
+        case type_name:
+            return _DECODERS[type_name](value["value"])
+
+
+class _ModelLoader:
+    def __init__(self, refs):
+        self.refs = refs
+        self.loaded = {}
+
+    def load_all(self):
+        for label in self.refs:
+            self._load(label)
+
+    def _load(self, label):
+        if label not in self.loaded:
+            model = apps.get_model(label)
+            pks = [_decode(pk, self, lazy=False) for pk in self.refs[label]]
+            self.loaded[label] = model._base_manager.in_bulk(pks)
+        return self.loaded[label]
+
+    def get(self, label, pk):
+        try:
+            return self._load(label)[pk]
+        except KeyError:
+            model = apps.get_model(label)
+            raise model.DoesNotExist(
+                f"{model._meta.object_name} with pk {pk} does not exist"
+            ) from None
@@ -0,0 +1,108 @@
+"""Splitting a task into sub-tasks that several workers run in parallel.
+
+A task calls `add_subtasks` to queue its sub-tasks, and is waiting for them
+once it returns. When the last sub-task is done, the numbers in their results
+are added up into the parent's result and output, and the parent completes, or
+fails when any of its sub-tasks failed.
+"""
+
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from symfexit.worker import dependencies, serialization
+from symfexit.worker.models import Task
+from symfexit.worker.registry import current_task, task_registry
+
+
+def add_subtasks(name, calls):
+    """Queue a sub-task of the current task for every `(args, kwargs)` in `calls`."""
+    parent = current_task()
+    if parent is None:
+        raise RuntimeError("Sub-tasks can only be added from within a task")
+    registered = task_registry.get(name)
+    if registered is None:
+        raise ValueError(f"Unknown task {name}")
+
+    subtasks = Task.objects.bulk_create(
+        Task(
+            name=name,
+            payload=serialization.dumps(args, kwargs),
+            tenant_id=parent.tenant_id,
+            queue=registered.queue,
+            priority=registered.priority,
+            parent=parent,
+        )
+        for args, kwargs in calls
+    )
+    parent.status = Task.Status.WAITING
+    # bulk_create skips Task.save, so notify the workers once for all sub-tasks
+    with connection.cursor() as cursor:
+        cursor.execute("NOTIFY worker_task;")
+    if settings.RUN_TASKS_SYNC:
+        for subtask in subtasks:
+            task_registry.execute(subtask)
+    return subtasks
+
+
+def id_ranges(queryset, size):
+    """Split `queryset` into `(start, stop)` primary key ranges of about `size` rows.
+
+    Ranges are half-open, and the last one has no `stop`, so together they
+    cover rows added after the split too.
+    """
+    starts = []
+    for position, pk in enumerate(queryset.order_by("pk").values_list("pk", flat=True).iterator()):
+        if position % size == 0:
+            starts.append(pk)
+    return list(zip(starts, [*starts[1:], None], strict=True))
+
+
+def in_range(queryset, start, stop):
+    """The rows of `queryset` in a range returned by `id_ranges`."""
+    queryset = queryset.filter(pk__gte=start)
+    if stop is not None:
+        queryset = queryset.filter(pk__lt=stop)
+    return queryset
+
+
+def task_finished(task):
+    """Join the sub-tasks of `task`'s parent, or of `task` itself, when all are done."""
+    if task.status == Task.Status.WAITING:
+        join(task.id)
+        task.refresh_from_db()
+    elif task.parent_id is not None and task.status not in Task.ACTIVE_STATUSES:
+        join(task.parent_id)
+
+
+def join(parent_id):
+    # Locking the parent serializes sub-tasks finishing at the same time, so
+    # exactly one of them sees that all others are done.
+    with transaction.atomic():
+        parent = Task.objects.select_for_update().filter(id=parent_id).first()
+        if parent is None or parent.status != Task.Status.WAITING:
+            return
+        if parent.subtasks.active().exists():
+            return
+        totals = Counter()
+        completed = failed = 0
+        for status, result in parent.subtasks.values_list("status", "result"):
+            if status != Task.Status.COMPLETED:
+                failed += 1
+                continue
+            completed += 1
+            if isinstance(result, dict):
+                totals.update(
+                    {key: value for key, value in result.items() if isinstance(value, int)}
+                )
+        summary = f"Sub-tasks done: {completed} completed, {failed} failed"
+        if totals:
+            summary += "; " + ", ".join(f"{key} {value}" for key, value in sorted(totals.items()))
+        parent.output = "\n\n".join(filter(None, [parent.output, summary]))
+        parent.result = dict(totals)
+        parent.status = Task.Status.EXCEPTION if failed else Task.Status.COMPLETED
+        parent.completed_at = timezone.now()
+        parent.save()
+    dependencies.task_finished(parent)
@@ -0,0 +1,20 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+
+from symfexit.worker.registry import Schedule, task_registry
+from symfexit.worker.retention import prune_tasks
+
+
+@task_registry.register(
+    "prune_tasks",
+    atomic=False,
+    schedule=Schedule(every=timedelta(days=1), offset=timedelta(hours=4)),
+)
+def prune_old_tasks():
+    """Archive the tenant's tasks that finished more than WORKER_TASK_RETENTION_DAYS ago.
+
+    The prune_tasks command does the same for all tenants, or with other options.
+    """
+    return prune_tasks(days=settings.WORKER_TASK_RETENTION_DAYS, tenant=connection.tenant)
@@ -0,0 +1,80 @@
+"""Per-process cache of tenant singletons, for the worker.
+
+Tasks load the same few rows, such as ledger accounts and payment provider
+settings, over and over for every task of a tenant. The worker enables this
+cache, so those rows are loaded once per process and tenant. Outside the worker
+`get` always misses, so web requests keep reading the database.
+
+Saving or deleting a model registered with `invalidate_on_change` drops the
+tenant's entries in this process, and in every worker through a NOTIFY on
+`CHANNEL`, which Postgres only delivers once the transaction commits.
+"""
+
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_save
+
+CHANNEL = "worker_cache"
+
+_enabled = False
+# schema name -> key -> value
+_entries = {}
+# Bumped by every clear, so stores still pending from before it are dropped
+_generation = 0
+
+
+def enable():
+    global _enabled  # noqa: PLW0603
+    _enabled = True
+
+
+def get(key, default=None):
+    """The value cached for `key` in the current tenant, or `default`."""
+    if not _enabled:
+        return default
+    return _entries.get(connection.schema_name, {}).get(key, default)
+
+
+def store(key, value):
+    """Cache `value` for `key` in the current tenant once the transaction commits.
+
+    A row read in a transaction that rolls back, or that the transaction
+    changes afterwards, may not exist like that once it is over, so it isn't
+    cached then.
+    """
+    if not _enabled:
+        return
+    schema_name = connection.schema_name
+    generation = _generation
+
+    def _store():
+        if _generation == generation:
+            _entries.setdefault(schema_name, {})[key] = value
+
+    transaction.on_commit(_store)
+
+
+def clear(schema_name=None):
+    """Drop the entries of one tenant in this process, or of all tenants."""
+    global _generation  # noqa: PLW0603
+    _generation += 1
+    if schema_name is None:
+        _entries.clear()
+    else:
+        _entries.pop(schema_name, None)
+
+
+def invalidate():
+    """Drop the current tenant's entries in this process and in every worker."""
+    clear(connection.schema_name)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_notify(%s, %s)", [CHANNEL, connection.schema_name])
+
+
+def invalidate_on_change(*models):
+    for model in models:
+        post_save.connect(_changed, sender=model, dispatch_uid=f"tenantcache_save_{model}")
+        post_delete.connect(_changed, sender=model, dispatch_uid=f"tenantcache_delete_{model}")
+
+
+def _changed(sender, **kwargs):
+    invalidate()
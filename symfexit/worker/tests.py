@@ -1 +1,657 @@
-# Create your tests here.
+import json
+from datetime import UTC, date, datetime, time, timedelta
+from decimal import Decimal
+from unittest.mock import patch
+from uuid import UUID, uuid4
+
+from django.contrib.auth import get_user_model
+from django.http import Http404
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from django_tenants.test.cases import FastTenantTestCase
+from django_tenants.test.client import TenantClient
+
+from symfexit.tenants.models import Client
+from symfexit.worker import locks, logger
+from symfexit.worker.asyncworker import AsyncWorker
+from symfexit.worker.chunks import run_in_chunks
+from symfexit.worker.management.commands.startworker import Command
+from symfexit.worker.metrics import queue_depth, render_prometheus, task_statistics
+from symfexit.worker.models import CLAIM_OVERFETCH, ScheduleState, Task, TaskArchive
+from symfexit.worker.pool import WorkerPool
+from symfexit.worker.ratelimit import RateLimit, RateLimited, acquire
+from symfexit.worker.registry import (
+    DuplicateTask,
+    RetryPolicy,
+    Schedule,
+    add_task,
+    task_registry,
+)
+from symfexit.worker.retention import prune_tasks
+from symfexit.worker.scheduler import run_due_schedules
+from symfexit.worker.serialization import dumps, loads
+from symfexit.worker.subtasks import add_subtasks, id_ranges, in_range
+from symfexit.worker.tasks import prune_old_tasks
+from symfexit.worker.views import metrics
+from symfexit.worker.workerlogger import TaskLog
+
+
+class TestTaskTimings(SimpleTestCase):
+    def test_latency_and_duration(self):
+        created = datetime(2026, 1, 1, 12, 0, tzinfo=UTC)
+        task = Task(
+            name="noop",
+            created_at=created,
+            picked_up_at=created + timedelta(seconds=2),
+            completed_at=created + timedelta(seconds=5),
+        )
+        self.assertEqual(task.queue_latency, timedelta(seconds=2))
+        self.assertEqual(task.run_duration, timedelta(seconds=3))
+
+    def test_not_picked_up(self):
+        task = Task(name="noop", created_at=datetime(2026, 1, 1, tzinfo=UTC))
+        self.assertIsNone(task.queue_latency)
+        self.assertIsNone(task.run_duration)
+
+
+class TransientError(Exception):
+    pass
+
+
+@task_registry.register(
+    "test_flaky",
+    retry=RetryPolicy(max_retries=2, delay=timedelta(seconds=10), retry_on=(TransientError,)),
+)
+def flaky(exception_class=TransientError):
+    logger.log("flaky task running")
+    raise exception_class("boom")
+
+
+@task_registry.register("test_noop", queue="bulk", priority=Task.Priority.LOW)
+def noop(*args, **kwargs):
+    logger.log(f"noop called with {args} {kwargs}")
+
+
+class TestAddTask(FastTenantTestCase):
+    def test_registered_defaults(self):
+        task = add_task("test_noop", 1, key="value")
+        task.refresh_from_db()
+        self.assertEqual(task.queue, "bulk")
+        self.assertEqual(task.priority, Task.Priority.LOW)
+        self.assertEqual(task.status, Task.Status.COMPLETED)
+        self.assertIn("noop called with (1,) {'key': 'value'}", task.output)
+
+    def test_override_queue_and_priority(self):
+        task = add_task("test_noop", queue="interactive", priority=Task.Priority.HIGH)
+        task.refresh_from_db()
+        self.assertEqual(task.queue, "interactive")
+        self.assertEqual(task.priority, Task.Priority.HIGH)
+
+    def test_unknown_task(self):
+        with self.assertRaises(ValueError):
+            add_task("does_not_exist")
+
+    def test_dedupe_key(self):
+        later = timezone.now() + timedelta(hours=1)
+        task = add_task("test_noop", run_at=later, dedupe_key="once")
+        with self.assertRaises(DuplicateTask) as cm:
+            add_task("test_noop", run_at=later, dedupe_key="once")
+        self.assertEqual(cm.exception.task, task)
+        self.assertEqual(Task.objects.count(), 1)
+
+        # Keys are free again once the task is done
+        Task.objects.filter(id=task.id).update(status=Task.Status.COMPLETED)
+        add_task("test_noop", run_at=later, dedupe_key="once")
+        # Tasks without a key are never deduplicated
+        add_task("test_noop", run_at=later)
+        add_task("test_noop", run_at=later)
+        self.assertEqual(Task.objects.count(), 4)
+
+    def test_delayed_task_is_not_run_sync(self):
+        task = add_task("test_noop", run_at=timezone.now() + timedelta(hours=1))
+        task.refresh_from_db()
+        self.assertEqual(task.status, Task.Status.QUEUED)
+        self.assertFalse(Task.objects.due().filter(id=task.id).exists())
+        self.assertTrue(Task.objects.delayed().filter(id=task.id).exists())
+
+
+class TestRetryPolicy(SimpleTestCase):
+    def test_exponential_backoff(self):
+        policy = RetryPolicy(
+            max_retries=10, delay=timedelta(seconds=30), max_delay=timedelta(minutes=5)
+        )
+        self.assertEqual(policy.delay_for(1), timedelta(seconds=30))
+        self.assertEqual(policy.delay_for(2), timedelta(seconds=60))
+        self.assertEqual(policy.delay_for(3), timedelta(seconds=120))
+        self.assertEqual(policy.delay_for(5), timedelta(minutes=5))
+
+    def test_should_retry(self):
+        policy = RetryPolicy(max_retries=1, retry_on=(TransientError,))
+        self.assertTrue(policy.should_retry(TransientError(), 1))
+        self.assertFalse(policy.should_retry(TransientError(), 2))
+        self.assertFalse(policy.should_retry(ValueError(), 1))
+
+
+class TestTaskRetries(FastTenantTestCase):
+    def test_failed_task_is_rescheduled(self):
+        task = add_task("test_flaky")
+        task.refresh_from_db()
+        self.assertEqual(task.status, Task.Status.QUEUED)
+        self.assertEqual(task.attempts, 1)
+        self.assertIsNotNone(task.run_at)
+        self.assertIsNone(task.completed_at)
+        self.assertIn("Retrying at", task.output)
+
+        task_registry.execute(task)
+        task_registry.execute(task)
+        task.refresh_from_db()
+        self.assertEqual(task.status, Task.Status.EXCEPTION)
+        self.assertEqual(task.attempts, 3)
+        self.assertEqual(task.output.count("flaky task running"), 3)
+
+    def test_other_exceptions_are_not_retried(self):
+        task = add_task("test_flaky", exception_class=ValueError)
+        task.refresh_from_db()
+        self.assertEqual(task.status, Task.Status.EXCEPTION)
+        self.assertEqual(task.attempts, 1)
+
+
+class TestTaskLog(SimpleTestCase):
+    def test_output(self):
+        task_log = TaskLog()
+        task_log.log("first")
+        task_log.log("second")
+        lines = task_log.get_output().split("\n")
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].endswith(": first"))
+        self.assertTrue(lines[1].endswith(": second"))
+
+    def test_keeps_output_of_earlier_attempts(self):
+        task_log = TaskLog(initial="attempt one")
+        task_log.log("attempt two")
+        output = task_log.get_output()
+        self.assertTrue(output.startswith("attempt one\n\n"), output)
+        self.assertTrue(output.endswith(": attempt two"), output)
+
+    def test_truncates_but_keeps_last_lines(self):
+        task_log = TaskLog(max_chars=500, tail_lines=3)
+        for i in range(100):
+            task_log.log(f"line {i}")
+        output = task_log.get_output()
+        self.assertLess(len(output), 1000)
+        self.assertIn(": line 0\n", output)
+        self.assertIn("lines truncated", output)
+        self.assertTrue(output.endswith(": line 99"), output)
+        self.assertIn(": line 97", output)
+        self.assertNotIn(": line 96", output)
+
+
+class TestClaim(FastTenantTestCase):
+    def test_claim_and_requeue_abandoned(self):
+        task = Task.objects.create(name="test_noop", tenant=self.tenant)
+
+        claimed = Task.objects.due().claim(10)
+        self.assertEqual([t.id for t in claimed], [task.id])
+        task.refresh_from_db()
+        self.assertEqual(task.status, Task.Status.RUNNING)
+        self.assertIsNotNone(task.picked_up_at)
+        self.assertEqual(Task.objects.due().claim(10), [])
+
+        # Simulate the worker going away
+        locks.release(locks.TASK_LOCK, task.id)
+        self.assertEqual(Task.objects.requeue_abandoned(), 1)
+        task.refresh_from_db()
+        self.assertEqual(task.status, Task.Status.QUEUED)
+
+    def _other_tenant(self, schema_name="other"):
+        other = Client(schema_name=schema_name, name=schema_name.title())
+        other.auto_create_schema = False
+        other.save()
+        return other
+
+    def test_claim_takes_turns_between_tenants(self):
+        other = self._other_tenant()
+        busy = [Task.objects.create(name="test_noop", tenant=self.tenant) for _ in range(5)]
+        quiet = Task.objects.create(name="test_noop", tenant=other)
+
+        claimed = Task.objects.due().claim(2)
+        self.assertEqual({t.id for t in claimed}, {busy[0].id, quiet.id})
+
+    def test_claim_respects_tenant_concurrency(self):
+        other = self._other_tenant()
+        Task.objects.create(name="test_noop", tenant=self.tenant, status=Task.Status.RUNNING)
+        Task.objects.create(name="test_noop", tenant=self.tenant)
+        quiet = Task.objects.create(name="test_noop", tenant=other)
+
+        claimed = Task.objects.due().claim(10, tenant_concurrency=1)
+        self.assertEqual([t.id for t in claimed], [quiet.id])
+
+    def test_claim_skips_tenants_at_their_cap(self):
+        # The oldest queued tasks all belong to tenants that are at their cap
+        for i in range(CLAIM_OVERFETCH + 1):
+            busy = self._other_tenant(f"busy{i}")
+            Task.objects.create(name="test_noop", tenant=busy, status=Task.Status.RUNNING)
+            Task.objects.create(name="test_noop", tenant=busy)
+        quiet = Task.objects.create(name="test_noop", tenant=self.tenant)
+
+        claimed = Task.objects.due().claim(1, tenant_concurrency=1)
+        self.assertEqual([t.id for t in claimed], [quiet.id])
+
+    def test_claim_runs_exclusive_tasks_one_at_a_time(self):
+        other = self._other_tenant()
+        first = Task.objects.create(name="test_exclusive", tenant=self.tenant)
+        Task.objects.create(name="test_exclusive", tenant=self.tenant)
+        elsewhere = Task.objects.create(name="test_exclusive", tenant=other)
+
+        claimed = Task.objects.due().claim(10)
+        self.assertEqual({t.id for t in claimed}, {first.id, elsewhere.id})
+        self.assertEqual(Task.objects.due().claim(10), [])
+
+        # Waiting for sub-tasks still counts as running
+        first.status = Task.Status.WAITING
+        first.save()
+        self.assertEqual(Task.objects.due().claim(10), [])
+
+        first.status = Task.Status.COMPLETED
+        first.save()
+        self.assertEqual(len(Task.objects.due().claim(10)), 1)
+
+    def test_drain_claims_each_task_when_it_starts(self):
+        tasks = [Task.objects.create(name="test_noop", tenant=self.tenant) for _ in range(3)]
+        started = []
+
+        def handle_task(task):
+            # The tasks after this one are still queued, for other workers to take
+            statuses = Task.objects.filter(id__in=[t.id for t in tasks]).values_list(
+                "status", flat=True
+            )
+            started.append(sorted(statuses))
+            locks.release(locks.TASK_LOCK, task.id)
+            Task.objects.filter(id=task.id).update(status=Task.Status.COMPLETED)
+
+        command = Command()
+        with patch.object(command, "handle_task", handle_task):
+            self.assertEqual(command.drain(batch_size=2), 2)
+        self.assertEqual(
+            started,
+            [
+                sorted([Task.Status.RUNNING, Task.Status.QUEUED, Task.Status.QUEUED]),
+                sorted([Task.Status.COMPLETED, Task.Status.RUNNING, Task.Status.QUEUED]),
+            ],
+        )
+
+    def test_claim_passes_exclusive_tasks_that_already_run(self):
+        # The parent waits for its sub-tasks, queued after the second run
+        parent = Task.objects.create(
+            name="test_exclusive", tenant=self.tenant, status=Task.Status.WAITING
+        )
+        Task.objects.create(name="test_exclusive", tenant=self.tenant)
+        chunk = Task.objects.create(name="test_noop", tenant=self.tenant, parent=parent)
+
+        claimed = Task.objects.due().claim(1)
+        self.assertEqual([t.id for t in claimed], [chunk.id])
+
+
+@task_registry.register("test_exclusive", exclusive=True)
+def exclusive_task():
+    pass
+
+
+class TestSerialization(FastTenantTestCase):
+    def test_round_trip(self):
+        values = [
+            None,
+            True,
+            3,
+            1.5,
+            "text",
+            [1, "two"],
+            (1, 2),
+            {"key": "value"},
+            {1: "int key"},
+            {"__type__": "not a tag"},
+            date(2026, 1, 31),
+            datetime(2026, 1, 31, 12, 30, tzinfo=UTC),
+            time(9, 15),
+            timedelta(days=1, seconds=5),
+            Decimal("12.50"),
+            UUID("12345678-1234-5678-1234-567812345678"),
+        ]
+        payload = json.loads(json.dumps(dumps(values, {"now": date(2026, 2, 1)})))
+        args, kwargs = loads(payload)
+        self.assertEqual(args, values)
+        self.assertEqual(kwargs, {"now": date(2026, 2, 1)})
+
+    def test_models_are_loaded_per_model(self):
+        payload = dumps([self.tenant, self.tenant], {"tenant": self.tenant})
+        self.assertEqual(payload["models"], {"tenants.client": [self.tenant.pk]})
+        with self.assertNumQueries(1):
+            args, kwargs = loads(payload)
+        self.assertEqual(args, [self.tenant, self.tenant])
+        self.assertEqual(kwargs["tenant"], self.tenant)
+
+    def test_lazy_models(self):
+        payload = dumps([], {"tenant": self.tenant})
+        with self.assertNumQueries(0):
+            args, kwargs = loads(payload, lazy=True)
+        with self.assertNumQueries(1):
+            self.assertEqual(kwargs["tenant"].name, self.tenant.name)
+
+    def test_unsupported_values(self):
+        with self.assertRaises(TypeError):
+            dumps([object()], {})
+        with self.assertRaises(TypeError):
+            dumps([Task()], {})
+
+
+class TestPruneTasks(FastTenantTestCase):
+    def _task(self, status, age_days):
+        task = Task.objects.create(
+            name="test_noop", tenant=self.tenant, status=status, output="some output"
+        )
+        completed_at = timezone.now() - timedelta(days=age_days)
+        Task.objects.filter(id=task.id).update(completed_at=completed_at)
+        return task
+
+    def test_archives_old_finished_tasks(self):
+        old = self._task(Task.Status.COMPLETED, age_days=40)
+        old_failed = self._task(Task.Status.EXCEPTION, age_days=40)
+        recent = self._task(Task.Status.COMPLETED, age_days=1)
+        queued = self._task(Task.Status.QUEUED, age_days=40)
+
+        self.assertEqual(prune_tasks(days=30, batch_size=1), 2)
+
+        remaining = set(Task.objects.values_list("id", flat=True))
+        self.assertEqual(remaining, {recent.id, queued.id})
+        archived = TaskArchive.objects.get(task_id=old.id)
+        self.assertEqual(archived.output, "some output")
+        self.assertEqual(archived.status, Task.Status.COMPLETED)
+        self.assertTrue(TaskArchive.objects.filter(task_id=old_failed.id).exists())
+
+    def test_delete_without_archive(self):
+        self._task(Task.Status.COMPLETED, age_days=40)
+        self.assertEqual(prune_tasks(days=30, archive=False), 1)
+        self.assertFalse(Task.objects.exists())
+        self.assertFalse(TaskArchive.objects.exists())
+
+    def test_scheduled_pruning_keeps_other_tenants_tasks(self):
+        self.assertIsNotNone(task_registry.get("prune_tasks").schedule)
+        old = self._task(Task.Status.COMPLETED, age_days=40)
+        other = Client(schema_name="other", name="Other")
+        other.auto_create_schema = False
+        other.save()
+        elsewhere = Task.objects.create(
+            name="test_noop",
+            tenant=other,
+            status=Task.Status.COMPLETED,
+            completed_at=timezone.now() - timedelta(days=40),
+        )
+
+        with override_settings(WORKER_TASK_RETENTION_DAYS=30):
+            self.assertEqual(prune_old_tasks(), 1)
+        self.assertTrue(TaskArchive.objects.filter(task_id=old.id).exists())
+        self.assertTrue(Task.objects.filter(id=elsewhere.id).exists())
+
+
+class TestMetrics(FastTenantTestCase):
+    def _finished(self, status, waited, ran):
+        now = timezone.now()
+        task = Task.objects.create(name="test_noop", tenant=self.tenant, status=status)
+        Task.objects.filter(id=task.id).update(
+            created_at=now - waited - ran,
+            picked_up_at=now - ran,
+            completed_at=now,
+        )
+
+    def test_queue_depth(self):
+        Task.objects.create(name="test_noop", tenant=self.tenant)
+        Task.objects.create(name="test_noop", tenant=self.tenant)
+        depth = queue_depth()
+        self.assertEqual(len(depth), 1)
+        self.assertEqual(depth[0]["tenant"], self.tenant.schema_name)
+        self.assertEqual(depth[0]["status"], Task.Status.QUEUED)
+        self.assertEqual(depth[0]["count"], 2)
+
+    def test_task_statistics(self):
+        self._finished(Task.Status.COMPLETED, timedelta(seconds=1), timedelta(seconds=10))
+        self._finished(Task.Status.COMPLETED, timedelta(seconds=3), timedelta(seconds=10))
+        self._finished(Task.Status.EXCEPTION, timedelta(seconds=2), timedelta(seconds=10))
+        [row] = task_statistics(timedelta(minutes=5))
+        self.assertEqual((row["completed"], row["failed"]), (2, 1))
+        self.assertAlmostEqual(row["failure_rate"], 1 / 3)
+        self.assertEqual(row["latency"][0.5], timedelta(seconds=2))
+        self.assertEqual(row["duration"][0.5], timedelta(seconds=10))
+
+    def test_render_prometheus(self):
+        Task.objects.create(name="test_noop", tenant=self.tenant)
+        self.assertIn(
+            f'symfexit_worker_tasks{{tenant="{self.tenant.schema_name}",task="test_noop",'
+            f'status="queued"}} 1',
+            render_prometheus(),
+        )
+
+    def test_endpoint_requires_token(self):
+        factory = RequestFactory()
+        with override_settings(WORKER_METRICS_TOKEN=None), self.assertRaises(Http404):
+            metrics(factory.get("/metrics/worker"))
+        with override_settings(WORKER_METRICS_TOKEN="secret"):
+            self.assertEqual(metrics(factory.get("/metrics/worker")).status_code, 401)
+            request = factory.get("/metrics/worker", headers={"Authorization": "Bearer secret"})
+            self.assertEqual(metrics(request).status_code, 200)
+
+    def test_tenant_task_changelist_has_no_metrics_link(self):
+        # The metrics view only exists on the global admin
+        client = TenantClient(self.tenant)
+        client.force_login(get_user_model().objects.create_superuser(email="admin@example.com"))
+        response = client.get(reverse("admin:worker_task_changelist"))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, "metrics/")
+
+
+@task_registry.register("test_scheduled", schedule=Schedule(every=timedelta(hours=1)))
+def test_scheduled():
+    pass
+
+
+class TestSchedule(SimpleTestCase):
+    def test_next_run_after(self):
+        schedule = Schedule(every=timedelta(days=1), offset=timedelta(hours=2))
+        moment = datetime(2026, 1, 1, 12, 0, tzinfo=UTC)
+        self.assertEqual(schedule.next_run_after(moment), datetime(2026, 1, 2, 2, 0, tzinfo=UTC))
+
+    def test_next_run_after_exact_time(self):
+        schedule = Schedule(every=timedelta(hours=1))
+        moment = datetime(2026, 1, 1, 12, 0, tzinfo=UTC)
+        self.assertEqual(schedule.next_run_after(moment), datetime(2026, 1, 1, 13, 0, tzinfo=UTC))
+
+
+class TestRunDueSchedules(FastTenantTestCase):
+    def test_first_run_waits_for_next_slot(self):
+        self.assertNotIn("test_scheduled", run_due_schedules())
+        self.assertGreater(
+            ScheduleState.objects.get(name="test_scheduled").next_run_at, timezone.now()
+        )
+        self.assertFalse(Task.objects.filter(name="test_scheduled").exists())
+
+    def test_fires_once_when_due(self):
+        now = timezone.now()
+        ScheduleState.objects.create(name="test_scheduled", next_run_at=now - timedelta(hours=5))
+
+        self.assertIn("test_scheduled", run_due_schedules(now))
+        self.assertNotIn("test_scheduled", run_due_schedules(now))
+
+        task = Task.objects.get(name="test_scheduled", tenant=self.tenant)
+        self.assertEqual(task.status, Task.Status.COMPLETED)
+        state = ScheduleState.objects.get(name="test_scheduled")
+        self.assertEqual(state.last_run_at, now)
+        self.assertGreater(state.next_run_at, now)
+
+
+@task_registry.register("test_fan_out")
+def test_fan_out(*values):
+    add_subtasks("test_count", [((value,), {}) for value in values])
+
+
+@task_registry.register("test_count")
+def test_count(value):
+    if value < 0:
+        raise ValueError("negative")
+    return {"counted": value}
+
+
+class TestSubtasks(FastTenantTestCase):
+    def test_join_adds_up_results(self):
+        parent = add_task("test_fan_out", 1, 2, 3)
+
+        self.assertEqual(parent.status, Task.Status.COMPLETED)
+        self.assertEqual(parent.result, {"counted": 6})
+        self.assertIn("Sub-tasks done: 3 completed, 0 failed; counted 6", parent.output)
+        self.assertEqual(parent.subtasks.count(), 3)
+
+    def test_failed_subtask_fails_parent(self):
+        parent = add_task("test_fan_out", 1, -1)
+
+        self.assertEqual(parent.status, Task.Status.EXCEPTION)
+        self.assertEqual(parent.result, {"counted": 1})
+        self.assertIsNotNone(parent.completed_at)
+
+    def test_add_subtasks_outside_task(self):
+        with self.assertRaises(RuntimeError):
+            add_subtasks("test_count", [((1,), {})])
+
+    def test_id_ranges_cover_all_rows(self):
+        tasks = [Task.objects.create(name="test_noop", tenant=self.tenant) for _ in range(5)]
+        ranges = id_ranges(Task.objects.all(), 2)
+
+        self.assertEqual(len(ranges), 3)
+        self.assertIsNone(ranges[-1][1])
+        covered = [
+            pk
+            for start, stop in ranges
+            for pk in in_range(Task.objects.all(), start, stop).values_list("id", flat=True)
+        ]
+        self.assertCountEqual(covered, [task.id for task in tasks])
+
+
+@task_registry.register("test_chunked", atomic=False)
+def test_chunked(fail_at=None):
+    def handle(rows):
+        if any(row.id == fail_at for row in rows):
+            raise ValueError("failing row")
+        return {"seen": len(rows)}
+
+    return run_in_chunks(Task.objects.filter(name="test_noop"), 2, handle)
+
+
+class TestRunInChunks(FastTenantTestCase):
+    def setUp(self):
+        self.rows = [Task.objects.create(name="test_noop", tenant=self.tenant) for _ in range(5)]
+
+    def test_records_progress(self):
+        task = add_task("test_chunked")
+
+        self.assertEqual(task.status, Task.Status.COMPLETED)
+        self.assertEqual(task.result, {"seen": 5})
+        task.refresh_from_db()
+        self.assertEqual(task.progress, {"after": self.rows[-1].id, "totals": {"seen": 5}})
+
+    def test_resumes_after_last_committed_chunk(self):
+        task = add_task("test_chunked", fail_at=self.rows[3].id)
+
+        self.assertEqual(task.status, Task.Status.EXCEPTION)
+        task.refresh_from_db()
+        self.assertEqual(task.progress, {"after": self.rows[1].id, "totals": {"seen": 2}})
+
+        self.rows[3].delete()
+        task_registry.execute(task)
+        self.assertEqual(task.status, Task.Status.COMPLETED)
+        self.assertEqual(task.result, {"seen": 4})
+
+
+@task_registry.register("test_async", max_concurrency=2)
+async def test_async(value):
+    return {"value": value}
+
+
+class TestAsyncTasks(FastTenantTestCase):
+    def test_coroutine_task_runs(self):
+        task = add_task("test_async", 3)
+
+        self.assertEqual(task.status, Task.Status.COMPLETED)
+        self.assertEqual(task.result, {"value": 3})
+
+    def test_saturated_task_types(self):
+        worker = AsyncWorker(None, queues=None, max_tasks=10, sweep_interval=30.0)
+        worker.running.update({"test_async": 2, "test_noop": 5})
+
+        self.assertEqual(worker.saturated(), ["test_async"])
+
+
+class TestWorkerPoolScaling(FastTenantTestCase):
+    def test_wanted_size_follows_backlog(self):
+        pool = WorkerPool(None, 1, None, max_size=4)
+        self.assertEqual(pool.wanted_size(), 1)
+
+        Task.objects.bulk_create(Task(name="test_noop", tenant=self.tenant) for _ in range(25))
+        # Tasks that were only just queued don't call for more workers yet
+        self.assertEqual(pool.wanted_size(), 1)
+
+        Task.objects.update(created_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(pool.wanted_size(), 4)
+
+        Task.objects.filter(id__in=Task.objects.values("id")[:10]).delete()
+        self.assertEqual(pool.wanted_size(), 3)
+
+
+class TestDependencies(FastTenantTestCase):
+    def test_runs_after_dependency_completes(self):
+        first = add_task("test_noop", run_at=timezone.now() + timedelta(hours=1))
+        second = add_task("test_noop", depends_on=[first])
+        self.assertEqual(second.status, Task.Status.BLOCKED)
+
+        task_registry.execute(first)
+
+        second.refresh_from_db()
+        self.assertEqual(second.status, Task.Status.COMPLETED)
+
+    def test_completed_dependency_queues_right_away(self):
+        first = add_task("test_noop")
+        second = add_task("test_noop", depends_on=[first])
+        self.assertEqual(second.status, Task.Status.COMPLETED)
+
+    def test_failed_dependency_fails_dependents(self):
+        first = add_task("test_count", -1, run_at=timezone.now() + timedelta(hours=1))
+        second = add_task("test_noop", depends_on=[first])
+        third = add_task("test_noop", depends_on=[second])
+
+        task_registry.execute(first)
+
+        second.refresh_from_db()
+        third.refresh_from_db()
+        self.assertEqual(second.status, Task.Status.EXCEPTION)
+        self.assertIn(f"because task {first.id} (test_count) failed", second.output)
+        self.assertEqual(third.status, Task.Status.EXCEPTION)
+        self.assertIsNotNone(third.completed_at)
+
+
+class TestRateLimit(FastTenantTestCase):
+    def test_burst_then_limited(self):
+        limit = RateLimit(f"test-{uuid4()}", rate=1, burst=2)
+
+        self.assertEqual(acquire(limit), 0)
+        self.assertEqual(acquire(limit), 0)
+        with self.assertRaises(RateLimited) as cm:
+            acquire(limit, max_wait=0.1)
+        self.assertGreater(cm.exception.wait, 0.5)
+
+    def test_limited_tokens_are_given_back(self):
+        limit = RateLimit(f"test-{uuid4()}", rate=1, burst=1)
+
+        acquire(limit)
+        with self.assertRaises(RateLimited):
+            acquire(limit, max_wait=0)
+        with self.assertRaises(RateLimited) as cm:
+            acquire(limit, max_wait=0)
+        # Without giving back, the second wait would be about two seconds
+        self.assertLess(cm.exception.wait, 1.5)
@@ -1 +1,19 @@
-# Create your views here.
+import secrets
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.views.decorators.http import require_GET
+
+from symfexit.worker.metrics import render_prometheus
+
+
+@require_GET
+def metrics(request):
+    """Worker metrics for Prometheus, authenticated with WORKER_METRICS_TOKEN."""
+    token = settings.WORKER_METRICS_TOKEN
+    if not token:
+        raise Http404()
+    authorization = request.headers.get("Authorization", "")
+    if not secrets.compare_digest(authorization, f"Bearer {token}"):
+        return HttpResponse("Unauthorized", status=401, headers={"WWW-Authenticate": "Bearer"})
+    return HttpResponse(render_prometheus(), content_type="text/plain; version=0.0.4")
@@ -1,15 +1,123 @@
+import logging
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
 from django.utils import timezone
 
+from symfexit.worker.db import side_connection
+
+python_logger = logging.getLogger(__name__)
+
+# Output beyond this many characters is dropped, except for the last lines
+MAX_OUTPUT_CHARS = 200_000
+TAIL_LINES = 50
+FLUSH_INTERVAL = 2.0
+
+_current_log = ContextVar("task_log", default=None)
 
-class Logger:
-    def __init__(self) -> None:
-        self.lines = []
 
-    def clear(self):
-        self.lines = []
+class TaskLog:
+    """Output of a single task run.
+
+    At most `max_chars` of output is kept; after that only the last `tail_lines`
+    lines are, behind a truncation marker, so memory use stays bounded. When a
+    `task_id` is given, the output is appended to that task's row every
+    `flush_interval` seconds so it can be followed while the task runs.
+    """
+
+    def __init__(
+        self,
+        task_id=None,
+        *,
+        initial="",
+        max_chars=MAX_OUTPUT_CHARS,
+        tail_lines=TAIL_LINES,
+        flush_interval=FLUSH_INTERVAL,
+    ):
+        self.task_id = task_id
+        self.max_chars = max_chars
+        self.flush_interval = flush_interval
+        # Output of earlier attempts, which is already stored on the task
+        self._initial = initial
+        self._head = []
+        self._head_chars = len(initial)
+        self._unflushed = 0
+        self._tail = deque(maxlen=tail_lines)
+        self._truncated = 0
+        self._last_flush = 0.0
 
     def log(self, line):
-        self.lines.append((timezone.now(), line))
+        entry = f"{timezone.now()}: {line}"
+        if not self._tail and self._head_chars + len(entry) < self.max_chars:
+            self._head.append(self._separator() + entry)
+            self._head_chars += len(self._head[-1])
+            self._unflushed += 1
+        else:
+            if len(self._tail) == self._tail.maxlen:
+                self._truncated += 1
+            self._tail.append(entry)
+        if self.task_id is not None and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def _separator(self):
+        if self._head:
+            return "\n"
+        if self._initial:
+            return "\n\n"
+        return ""
+
+    def flush(self):
+        """Append the lines logged since the last flush to the task's output."""
+        from symfexit.worker.models import Task  # noqa: PLC0415
+
+        self._last_flush = time.monotonic()
+        if self.task_id is None or not self._unflushed:
+            return
+        chunk = "".join(self._head[-self._unflushed :])
+        table = Task._meta.db_table
+        with side_connection().cursor() as cursor:
+            # The task's own transaction may hold the row lock, for example
+            # while it stores its progress. Waiting for it would deadlock, so
+            # the lines are kept for the next flush instead.
+            cursor.execute(
+                f"UPDATE {table} SET output = output || %s "
+                f"WHERE id = (SELECT id FROM {table} WHERE id = %s FOR UPDATE SKIP LOCKED)",
+                [chunk, self.task_id],
+            )
+            if cursor.rowcount == 0:
+                return
+        self._unflushed = 0
 
     def get_output(self):
-        return "\n".join(f"{t}: {line}" for t, line in self.lines)
+        output = self._initial + "".join(self._head)
+        if self._tail:
+            marker = f"[... {self._truncated} lines truncated ...]\n" if self._truncated else ""
+            output += f"\n{marker}" + "\n".join(self._tail)
+        return output
+
+
+class Logger:
+    """Writes lines to the output of the task that is currently running.
+
+    The current task is tracked per context, so concurrently running tasks each
+    get their own output. Lines logged outside of a task, for example when a
+    task function is called directly, go to the Python logger instead.
+    """
+
+    def log(self, line):
+        task_log = _current_log.get()
+        if task_log is None:
+            python_logger.info(line)
+        else:
+            task_log.log(line)
+
+    @contextmanager
+    def capture(self, task_id=None, *, initial=""):
+        task_log = TaskLog(task_id, initial=initial)
+        token = _current_log.set(task_log)
+        try:
+            yield task_log
+        finally:
+            _current_log.reset(token)